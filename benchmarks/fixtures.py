@@ -0,0 +1,205 @@
+"""
+Synthetic documents and database fixtures for the pipeline benchmark.
+"""
+import random
+from datetime import date, timedelta
+from pathlib import Path
+
+from PIL import Image, ImageDraw, ImageFont
+
+# EXIF Orientation values and the rotation that makes a correctly oriented
+# image look like the raw sensor output a phone would store with that tag
+EXIF_ORIENTATION_TAG = 0x0112
+EXIF_ROTATIONS = {3: 180, 6: 90, 8: 270}
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS `users` (
+        `id` INT PRIMARY KEY,
+        `age_verified` VARCHAR(10) NOT NULL DEFAULT 'no'
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS `avsdocs` (
+        `id` INT AUTO_INCREMENT PRIMARY KEY,
+        `user_id` INT NOT NULL,
+        `doc_url` VARCHAR(512) NOT NULL,
+        `doc_file_type` VARCHAR(100) NOT NULL,
+        `doc_approved` VARCHAR(10) NOT NULL DEFAULT 'no',
+        `is_deleted` VARCHAR(10) NOT NULL DEFAULT 'no'
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS `ocr_logs` (
+        `id` INT AUTO_INCREMENT PRIMARY KEY,
+        `doc_id` INT NOT NULL,
+        `user_id` INT NOT NULL,
+        `response_data` LONGTEXT NULL,
+        `dob` VARCHAR(20) NULL,
+        `status` VARCHAR(255) NOT NULL DEFAULT '0',
+        `file_path` VARCHAR(512) NOT NULL,
+        `file_disk_path` VARCHAR(512) NOT NULL,
+        `file_type` VARCHAR(100) NOT NULL,
+        `read_status` VARCHAR(20) NOT NULL DEFAULT 'pending'
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS `ocr_api_cost` (
+        `id` INT AUTO_INCREMENT PRIMARY KEY,
+        `file_id` INT NOT NULL,
+        `cost` DECIMAL(12, 6) NOT NULL,
+        `created_at` DATETIME NOT NULL
+    )
+    """,
+]
+
+
+def random_dob(rng):
+    return date(1950, 1, 1) + timedelta(days=rng.randrange(0, 365 * 55))
+
+
+def card_lines(rng, dob):
+    """
+    Returns the text lines printed on a synthetic ID card.
+    """
+    return [
+        "DRIVER LICENSE",
+        f"4d DL NO {rng.randrange(10**7, 10**8)}",
+        f"1 {rng.choice(['SMITH', 'GARCIA', 'MULLER', 'ROSSI', 'DUPONT'])}",
+        f"2 {rng.choice(['ALEX', 'MARIA', 'JEAN', 'LUCA', 'SAM'])}",
+        f"3 DATE OF BIRTH {dob.strftime('%d/%m/%Y')}",
+        f"4a ISS {date.today().strftime('%m/%d/%Y')}",
+        "8 123 MAIN STREET ANYTOWN",
+    ]
+
+
+def render_card(lines, size):
+    """
+    Draws the lines onto a white card of the given size.
+    """
+    width, height = size
+    image = Image.new("RGB", size, "white")
+    draw = ImageDraw.Draw(image)
+    font_size = max(12, height // 16)
+    try:
+        font = ImageFont.truetype("DejaVuSans.ttf", font_size)
+    except OSError:
+        font = ImageFont.load_default()
+
+    y = height // 12
+    for line in lines:
+        draw.text((width // 20, y), line, fill="black", font=font)
+        y += int(font_size * 1.4)
+    return image
+
+
+def write_image(path, lines, size, orientation=None):
+    """
+    Saves a JPEG card; with an orientation the pixels are rotated and the EXIF
+    tag set so the pipeline has to undo the rotation.
+    """
+    image = render_card(lines, size)
+    exif = Image.Exif()
+    if orientation in EXIF_ROTATIONS:
+        image = image.rotate(EXIF_ROTATIONS[orientation], expand=True)
+        exif[EXIF_ORIENTATION_TAG] = orientation
+    image.save(path, "JPEG", quality=90, exif=exif)
+
+
+def write_scanned_pdf(path, lines, pages):
+    """
+    Saves an image-only PDF, like a scanner or phone app produces.
+    """
+    images = [render_card(lines, (1700, 2200)) for _ in range(pages)]
+    images[0].save(path, "PDF", resolution=200, save_all=True, append_images=images[1:])
+
+
+def write_text_pdf(path, lines):
+    """
+    Saves a one-page PDF with a real text layer, written by hand so no PDF
+    library is needed.
+    """
+    text_ops = ["BT", "/F1 14 Tf", "72 720 Td", "18 TL"]
+    for line in lines:
+        escaped = line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+        text_ops.append(f"({escaped}) Tj T*")
+    text_ops.append("ET")
+    stream = "\n".join(text_ops).encode("latin-1")
+
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 5 0 R >> >> /Contents 4 0 R >>",
+        b"<< /Length " + str(len(stream)).encode() + b" >>\nstream\n" + stream + b"\nendstream",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n".encode() + body + b"\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    for offset in offsets:
+        out += f"{offset:010d} 00000 n \n".encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    Path(path).write_bytes(bytes(out))
+
+
+def generate_documents(upload_dir, count, seed=0):
+    """
+    Writes count synthetic documents into upload_dir with a realistic mix:
+    small and phone-sized photos (some EXIF-rotated), text PDFs and scanned
+    PDFs. Returns a list of (file_name, mime_type, dob) tuples.
+    """
+    rng = random.Random(seed)
+    upload_dir = Path(upload_dir)
+    upload_dir.mkdir(parents=True, exist_ok=True)
+
+    documents = []
+    for index in range(count):
+        dob = random_dob(rng)
+        lines = card_lines(rng, dob)
+        kind = rng.choices(["small", "large", "text_pdf", "scanned_pdf"], weights=[4, 3, 2, 1])[0]
+
+        if kind in ("small", "large"):
+            name = f"doc_{index}.jpg"
+            size = (1012, 638) if kind == "small" else (4032, 3024)
+            write_image(upload_dir / name, lines, size, orientation=rng.choice([None, 3, 6, 8]))
+            documents.append((name, "image/jpeg", dob))
+        elif kind == "text_pdf":
+            name = f"doc_{index}.pdf"
+            write_text_pdf(upload_dir / name, lines)
+            documents.append((name, "application/pdf", dob))
+        else:
+            name = f"doc_{index}.pdf"
+            write_scanned_pdf(upload_dir / name, lines, pages=rng.choice([1, 2]))
+            documents.append((name, "application/pdf", dob))
+
+    return documents
+
+
+def seed_database(connection, documents, url_prefix="/uploads/"):
+    """
+    Recreates the benchmark tables and inserts one user and one pending avsdocs row per document.
+    """
+    cursor = connection.cursor()
+    try:
+        for statement in SCHEMA:
+            cursor.execute(statement)
+        for table in ("ocr_api_cost", "ocr_logs", "avsdocs", "users"):
+            cursor.execute(f"TRUNCATE TABLE `{table}`")
+
+        cursor.executemany(
+            "INSERT INTO `users` (`id`, `age_verified`) VALUES (%s, 'no')",
+            [(user_id,) for user_id in range(1, len(documents) + 1)],
+        )
+        cursor.executemany(
+            "INSERT INTO `avsdocs` (`user_id`, `doc_url`, `doc_file_type`) VALUES (%s, %s, %s)",
+            [(user_id, f"{url_prefix}{name}", mime_type)
+             for user_id, (name, mime_type, _) in enumerate(documents, start=1)],
+        )
+        connection.commit()
+    finally:
+        cursor.close()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Measures cold import time of each pipeline module in a fresh interpreter.
+
+    python benchmarks/import_time.py [--runs 5] [--json]
+
+The `ingest` path (cli + dbread) should stay well under a second; the script
+exits with status 1 if it does not (threshold: IMPORT_BUDGET_SECONDS, default 1.0).
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+# What each CLI subcommand imports before doing any work
+TARGETS = {
+    "ingest": "import cli, dbread",
+    "ocr": "import cli, ocread",
+    "extract-dob": "import cli, ocrai",
+    "run-all": "import cli, pipeline",
+}
+
+
+def time_import(statement, runs):
+    """
+    Returns wall-clock seconds for each of runs fresh interpreters executing statement.
+    """
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", statement], cwd=REPO_DIR, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    # Baseline cost of starting the interpreter itself
+    baseline = statistics.median(time_import("pass", args.runs))
+
+    results = {"interpreter": baseline}
+    for name, statement in TARGETS.items():
+        results[name] = statistics.median(time_import(statement, args.runs))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for name, seconds in results.items():
+            print(f"{name:12s} {seconds * 1000:8.1f} ms")
+
+    budget = float(os.getenv("IMPORT_BUDGET_SECONDS", 1.0))
+    if results["ingest"] > budget:
+        print(f"ingest import took {results['ingest']:.2f}s, over the {budget:.2f}s budget", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
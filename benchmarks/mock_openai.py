@@ -0,0 +1,233 @@
+"""
+Minimal stand-in for the OpenAI chat completions, Files and Batch endpoints.
+
+Answers POST /v1/chat/completions after a configurable delay with the first
+date of birth it can find in the prompt, so the DOB stage can be benchmarked
+offline. Point the pipeline at it with OPENAI_BASE_URL=http://host:port/v1.
+
+With rate_limit_every=N every Nth chat request is answered with a 429 and a
+Retry-After header, to exercise the client-side rate limiter and retries.
+
+Bulk mode is covered by POST /v1/files, GET /v1/files/{id}/content and
+POST/GET /v1/batches: a batch answers every line of its input file the same
+way as the chat endpoint and completes after batch_latency seconds.
+"""
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import default as default_policy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DOB_LINE = re.compile(r"DATE OF BIRTH\s+(\d{2})/(\d{2})/(\d{4})")
+
+# Ids for uploaded files, batches and batch requests
+ids = itertools.count(1)
+
+
+def complete(body):
+    """
+    Returns a chat completion answering a request body with the DOB in its prompt.
+    """
+    prompt = " ".join(message.get("content", "") for message in body.get("messages", []))
+    match = DOB_LINE.search(prompt)
+    content = f"{match.group(3)}-{match.group(2)}-{match.group(1)}" if match else "unknown"
+    prompt_tokens = max(1, len(prompt) // 4)
+
+    return {
+        "id": "chatcmpl-mock",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "gpt-4o"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop",
+        }],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": 5, "total_tokens": prompt_tokens + 5},
+    }
+
+
+def parse_multipart(content_type, body):
+    """
+    Returns {field name: bytes} for a multipart/form-data request body.
+    """
+    message = BytesParser(policy=default_policy).parsebytes(
+        b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body
+    )
+    return {
+        part.get_param("name", header="content-disposition"): part.get_payload(decode=True)
+        for part in message.iter_parts()
+    }
+
+
+def store_file(server, content, purpose, filename):
+    file_id = f"file-mock{next(ids)}"
+    server.files[file_id] = {
+        "content": content,
+        "info": {
+            "id": file_id,
+            "object": "file",
+            "bytes": len(content),
+            "created_at": int(time.time()),
+            "filename": filename,
+            "purpose": purpose,
+            "status": "processed",
+        },
+    }
+    return server.files[file_id]["info"]
+
+
+def run_batch(server, batch):
+    """
+    Answers every request in the batch's input file, then marks it completed.
+    Runs on its own thread.
+    """
+    batch["status"] = "in_progress"
+    time.sleep(server.batch_latency)
+
+    output = []
+    for line in server.files[batch["input_file_id"]]["content"].decode().splitlines():
+        if not line.strip():
+            continue
+        request = json.loads(line)
+        output.append(json.dumps({
+            "id": f"batch_req_mock{next(ids)}",
+            "custom_id": request["custom_id"],
+            "response": {"status_code": 200, "request_id": f"req_mock{next(ids)}", "body": complete(request["body"])},
+            "error": None,
+        }))
+
+    with server.lock:
+        output_file = store_file(server, ("\n".join(output) + "\n").encode(), "batch_output", "output.jsonl")
+        batch["output_file_id"] = output_file["id"]
+        batch["request_counts"] = {"total": len(output), "completed": len(output), "failed": 0}
+        batch["completed_at"] = int(time.time())
+        batch["status"] = "completed"
+
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    def send_json(self, status, payload, headers=()):
+        payload = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return self.rfile.read(length)
+
+    def do_POST(self):
+        path = self.path.split("?")[0].rstrip("/")
+        if path.endswith("/chat/completions"):
+            self.chat_completion()
+        elif path.endswith("/files"):
+            self.upload_file()
+        elif path.endswith("/batches"):
+            self.create_batch()
+        else:
+            self.send_error(404)
+
+    def do_GET(self):
+        server = self.server
+        parts = self.path.split("?")[0].rstrip("/").split("/")
+        with server.lock:
+            if parts[-1] == "batches":
+                # Newest first, like the real API
+                batches = sorted(server.batches.values(), key=lambda b: b["created_at"], reverse=True)
+                self.send_json(200, {"object": "list", "data": batches, "has_more": False,
+                                     "first_id": batches[0]["id"] if batches else None,
+                                     "last_id": batches[-1]["id"] if batches else None})
+            elif parts[-2] == "batches" and parts[-1] in server.batches:
+                self.send_json(200, server.batches[parts[-1]])
+            elif parts[-1] == "content" and parts[-2] in server.files:
+                content = server.files[parts[-2]]["content"]
+                self.send_response(200)
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+            else:
+                self.send_error(404)
+
+    def chat_completion(self):
+        body = json.loads(self.read_body() or b"{}")
+
+        server = self.server
+        with server.lock:
+            server.request_count += 1
+            rate_limited = server.rate_limit_every and server.request_count % server.rate_limit_every == 0
+        if rate_limited:
+            server.rate_limited_count += 1
+            self.send_json(429, {"error": {"message": "Rate limit reached", "type": "requests",
+                                           "code": "rate_limit_exceeded"}},
+                           headers=[("Retry-After", str(server.retry_after))])
+            return
+
+        time.sleep(max(0.0, server.latency + random.uniform(-server.jitter, server.jitter)))
+        self.send_json(200, complete(body))
+
+    def upload_file(self):
+        fields = parse_multipart(self.headers.get("Content-Type", ""), self.read_body())
+        purpose = fields.get("purpose", b"batch").decode()
+        with self.server.lock:
+            info = store_file(self.server, fields.get("file", b""), purpose, "input.jsonl")
+        self.send_json(200, info)
+
+    def create_batch(self):
+        body = json.loads(self.read_body() or b"{}")
+        server = self.server
+        with server.lock:
+            if body.get("input_file_id") not in server.files:
+                self.send_json(400, {"error": {"message": "No such file", "type": "invalid_request_error"}})
+                return
+            batch = {
+                "id": f"batch_mock{next(ids)}",
+                "object": "batch",
+                "endpoint": body.get("endpoint", "/v1/chat/completions"),
+                "input_file_id": body["input_file_id"],
+                "completion_window": body.get("completion_window", "24h"),
+                "status": "validating",
+                "output_file_id": None,
+                "error_file_id": None,
+                "created_at": int(time.time()),
+                "request_counts": {"total": 0, "completed": 0, "failed": 0},
+                "metadata": body.get("metadata"),
+            }
+            server.batches[batch["id"]] = batch
+            self.send_json(200, batch)
+        threading.Thread(target=run_batch, args=(server, batch), daemon=True).start()
+
+    def log_message(self, format, *args):
+        # Keep benchmark output readable
+        pass
+
+
+def start_mock_server(latency=0.5, jitter=0.1, rate_limit_every=0, retry_after=1.0, batch_latency=1.0,
+                      host="127.0.0.1", port=0):
+    """
+    Starts the mock server on a background thread and returns (server, base_url).
+    server.request_count and server.rate_limited_count count the chat requests
+    seen; server.files and server.batches hold what was uploaded and created.
+    """
+    server = ThreadingHTTPServer((host, port), MockOpenAIHandler)
+    server.latency = latency
+    server.jitter = jitter
+    server.rate_limit_every = rate_limit_every
+    server.retry_after = retry_after
+    server.batch_latency = batch_latency
+    server.request_count = 0
+    server.rate_limited_count = 0
+    server.files = {}
+    server.batches = {}
+    server.lock = threading.Lock()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
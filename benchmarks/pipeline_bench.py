@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+End-to-end offline benchmark for ingest -> OCR -> DOB extraction.
+
+Generates synthetic ID cards (small and phone-sized, some EXIF-rotated),
+text PDFs and scanned PDFs, seeds a scratch MySQL/MariaDB database with
+users/avsdocs rows, and runs the stages against a local mock of the OpenAI
+chat completions endpoint.
+
+    DB_HOST=127.0.0.1 DB_USERNAME=root DB_PASSWORD=secret \\
+        python benchmarks/pipeline_bench.py --docs 50 --llm-latency 0.5 --output bench.json
+
+Pass --ocr-engine adaptive to try Tesseract before doctr; the OCR results
+then include the share of documents that never reached doctr.
+
+The tables in --database (default ocr_bench) are truncated on every run, so
+never point it at a real database. Results are printed as JSON: documents/sec,
+p50/p95/p99 latency for the stages timed per document (OCR and DOB; ingest
+runs in bulk) and peak RSS, plus the commit they were taken at.
+"""
+import argparse
+import json
+import math
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_DIR))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fixtures import generate_documents, seed_database  # noqa: E402
+from mock_openai import start_mock_server  # noqa: E402
+
+APP_URL = "http://bench.local"
+
+
+def percentile(values, fraction):
+    """
+    Nearest-rank percentile of a list of numbers.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    # Rounding first keeps float noise (0.95 * 20 = 19.000000000000004) from bumping the rank
+    index = max(0, math.ceil(round(fraction * len(ordered), 9)) - 1)
+    return ordered[index]
+
+
+def latency_percentiles(latencies):
+    """
+    p50/p95/p99 of per-document latencies, all None when latencies is None
+    (the stage has no per-document timings to report).
+    """
+    return {
+        "p50": percentile(latencies, 0.50) if latencies is not None else None,
+        "p95": percentile(latencies, 0.95) if latencies is not None else None,
+        "p99": percentile(latencies, 0.99) if latencies is not None else None,
+    }
+
+
+def summarise(name, latencies, elapsed, documents):
+    """
+    Throughput and latency summary for one stage. Pass latencies=None for
+    stages that are not timed per document; latency_measured is then false.
+    """
+    return {
+        "stage": name,
+        "documents": documents,
+        "seconds": round(elapsed, 4),
+        "docs_per_sec": round(documents / elapsed, 3) if elapsed else None,
+        "latency_measured": latencies is not None,
+        **latency_percentiles(latencies),
+    }
+
+
+def peak_rss_mb():
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def current_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def create_database(name):
+    """
+    Creates the scratch benchmark database if it does not exist yet.
+    """
+    import mysql.connector
+
+    connection = mysql.connector.connect(
+        host=os.getenv("DB_HOST"),
+        port=int(os.getenv("DB_PORT", 3306)),
+        user=os.getenv("DB_USERNAME"),
+        password=os.getenv("DB_PASSWORD"),
+    )
+    try:
+        cursor = connection.cursor()
+        cursor.execute(f"CREATE DATABASE IF NOT EXISTS `{name}`")
+        cursor.close()
+    finally:
+        connection.close()
+
+
+class ExpectedDobs:
+    """
+    Looks up the expected DOB for an ocr_logs id via its doc_id.
+    """
+
+    def __init__(self, by_doc_id):
+        self.by_doc_id = by_doc_id
+        self.doc_ids = None
+
+    def get(self, ocr_log_id):
+        if self.doc_ids is None:
+            import db
+            connection = db.get_connection()
+            cursor = connection.cursor()
+            cursor.execute("SELECT `id`, `doc_id` FROM `ocr_logs`")
+            self.doc_ids = dict(cursor.fetchall())
+            cursor.close()
+            connection.close()
+        return self.by_doc_id.get(self.doc_ids.get(ocr_log_id))
+
+
+def fast_engine_summary():
+    """
+    Reports how many OCR'd documents the fast engine handled without doctr.
+    """
+    import ocread
+
+    total = ocread.fast_engine_hits + ocread.fast_engine_escalations
+    return {
+        "fast_engine_hits": ocread.fast_engine_hits,
+        "escalated_to_doctr": ocread.fast_engine_escalations,
+        "skipped_doctr_share": round(ocread.fast_engine_hits / total, 3) if total else None,
+    }
+
+
+def run_stages(expected_dobs):
+    """
+    Runs each stage on its own and times every document.
+    """
+    import db
+    import dbread
+    import ocread
+    import ocrai
+
+    results = {}
+
+    start = time.perf_counter()
+    dbread.connect_and_read()
+    elapsed = time.perf_counter() - start
+    connection = db.get_connection()
+    cursor = connection.cursor()
+    cursor.execute("SELECT COUNT(*) FROM `ocr_logs`")
+    ingested = cursor.fetchone()[0]
+    cursor.close()
+    connection.close()
+    # Ingestion inserts in bulk, so there is no per-document latency to report
+    results["ingest"] = summarise("ingest", None, elapsed, ingested)
+
+    # Model load is reported on its own so OCR latencies reflect inference
+    start = time.perf_counter()
+    ocread.get_predictor()
+    results["model_load_seconds"] = round(time.perf_counter() - start, 3)
+
+    latencies = []
+    start = time.perf_counter()
+    for row in db.fetch_work(ocread.OCR_WORK_COLUMNS, "`read_status` = 'pending'"):
+        doc_start = time.perf_counter()
+        ocread.process_row(row)
+        latencies.append(time.perf_counter() - doc_start)
+    results["ocr"] = summarise("ocr", latencies, time.perf_counter() - start, len(latencies))
+    results["ocr"].update(fast_engine_summary())
+
+    latencies = []
+    correct = 0
+    connection = db.get_connection()
+    start = time.perf_counter()
+    for row in db.fetch_work(ocrai.OCRAI_WORK_COLUMNS, ocrai.OCRAI_WORK_FILTER):
+        doc_start = time.perf_counter()
+        dob = ocrai.extract_dob_from_text(row["response_data"], row["id"])
+        db.update_dob(connection, row["id"], dob if dob else '', ocrai.dob_status(dob))
+        latencies.append(time.perf_counter() - doc_start)
+        if dob and dob == expected_dobs.get(row["id"]):
+            correct += 1
+    ocrai.flush_costs(connection)
+    connection.close()
+    results["dob"] = summarise("dob", latencies, time.perf_counter() - start, len(latencies))
+    results["dob"]["correct"] = correct
+    results["dob"]["fast_path_hits"] = ocrai.fast_path_hits
+    results["dob"]["llm_calls"] = ocrai.llm_fallbacks
+
+    return results
+
+
+def run_end_to_end(documents):
+    """
+    Runs the pipelined orchestrator once and measures overall throughput.
+
+    The stages overlap and batch their work, so per-stage latencies are not
+    measured in this mode. time_to_dob reports, per document, the seconds
+    from the start of the run until its DOB was written back.
+    """
+    import db
+    import pipeline
+
+    done_at = []
+    update_dob = db.update_dob
+
+    def timed_update_dob(*args, **kwargs):
+        update_dob(*args, **kwargs)
+        done_at.append(time.perf_counter() - start)
+
+    db.update_dob = timed_update_dob
+    try:
+        start = time.perf_counter()
+        pipeline.run_pipeline()
+        elapsed = time.perf_counter() - start
+    finally:
+        db.update_dob = update_dob
+
+    results = {"pipeline": summarise("pipeline", None, elapsed, documents)}
+    results["pipeline"]["time_to_dob"] = latency_percentiles(done_at)
+    results["pipeline"].update(fast_engine_summary())
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=50, help="number of synthetic documents")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--database", default="ocr_bench", help="scratch database (truncated every run)")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="mock OpenAI response time in seconds")
+    parser.add_argument("--llm-jitter", type=float, default=0.1)
+    parser.add_argument("--llm-rate-limit-every", type=int, default=0,
+                        help="answer every Nth mock request with a 429 (0 disables)")
+    parser.add_argument("--llm-retry-after", type=float, default=1.0, help="Retry-After sent with mock 429s")
+    parser.add_argument("--mode", choices=["stages", "pipeline"], default="stages",
+                        help="time each stage separately, or the pipelined orchestrator end to end")
+    parser.add_argument("--ocr-engine", choices=["doctr", "adaptive"], default="doctr",
+                        help="OCR_ENGINE for the run")
+    parser.add_argument("--output", help="also write the JSON results to this file")
+    args = parser.parse_args()
+
+    work_dir = Path(tempfile.mkdtemp(prefix="ocr_bench_"))
+    server, base_url = start_mock_server(latency=args.llm_latency, jitter=args.llm_jitter,
+                                         rate_limit_every=args.llm_rate_limit_every,
+                                         retry_after=args.llm_retry_after)
+
+    # The stage modules read their settings from the environment on import
+    os.environ.update({
+        "APP_URL": APP_URL,
+        "FILE_DIRECTORY": str(work_dir),
+        "DB_DATABASE": args.database,
+        "OPENAI_BASE_URL": base_url,
+        "OPENAI_API_KEY": os.getenv("OPENAI_API_KEY", "bench"),
+        "OCR_CACHE_PATH": str(work_dir / "ocr_cache.sqlite3"),
+        "OCR_ENGINE": args.ocr_engine,
+    })
+
+    generate_start = time.perf_counter()
+    documents = generate_documents(work_dir / "uploads", args.docs, seed=args.seed)
+    generate_seconds = time.perf_counter() - generate_start
+
+    create_database(args.database)
+
+    import db
+    connection = db.get_connection()
+    try:
+        seed_database(connection, documents)
+    finally:
+        connection.close()
+
+    # avsdocs ids are assigned in document order, and ocr_logs ids follow ingestion
+    # order, so map expected DOBs through doc_id once ingestion has run
+    expected_by_doc = {doc_id: dob.isoformat() for doc_id, (_, _, dob) in enumerate(documents, start=1)}
+
+    if args.mode == "pipeline":
+        stages = run_end_to_end(len(documents))
+    else:
+        stages = run_stages(ExpectedDobs(expected_by_doc))
+
+    server.shutdown()
+
+    results = {
+        "commit": current_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {
+            "docs": args.docs,
+            "seed": args.seed,
+            "mode": args.mode,
+            "ocr_engine": args.ocr_engine,
+            "llm_latency": args.llm_latency,
+            "llm_jitter": args.llm_jitter,
+            "llm_rate_limit_every": args.llm_rate_limit_every,
+        },
+        "generate_seconds": round(generate_seconds, 3),
+        "stages": stages,
+        "llm_requests": server.request_count,
+        "llm_rate_limited": server.rate_limited_count,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+    output = json.dumps(results, indent=2, default=str)
+    print(output)
+    if args.output:
+        Path(args.output).write_text(output + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
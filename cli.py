@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Command line entry point for the OCR pipeline.
+
+    python cli.py ingest        # add new avsdocs uploads to ocr_logs
+    python cli.py ocr           # OCR pending ocr_logs rows
+    python cli.py extract-dob   # extract DOBs from OCR'd rows
+    python cli.py run-all       # all three stages as one pipeline
+    python cli.py watch         # run the pipeline whenever new uploads arrive
+
+    python cli.py --profile --profile-rate 0.1 ocr   # profile one document in ten
+
+Each subcommand imports only the modules it needs, so a light run such as
+`ingest` never loads doctr, torch, pdfplumber or openai.
+"""
+import argparse
+import os
+import sys
+
+
+def set_env(name, value):
+    """
+    Applies a CLI option to the environment variable the stage modules read.
+    Must run before the stage module is imported.
+    """
+    if value is not None:
+        os.environ[name] = str(value)
+
+
+def run_ingest(args):
+    from dbread import connect_and_read
+    connect_and_read()
+
+
+def run_ocr(args):
+    set_env("OCR_WORKERS", args.workers)
+    set_env("OCR_BATCH_SIZE", args.batch_size)
+    set_env("OCR_ENGINE", args.engine)
+    if args.roi:
+        set_env("OCR_ROI_MODE", 1)
+
+    import ocread
+    if args.worker:
+        ocread.run_ocr_worker()
+    else:
+        ocread.connect_and_read_oc()
+
+
+def run_extract_dob(args):
+    if args.use_async:
+        set_env("OCRAI_ASYNC", 1)
+    if args.bulk:
+        set_env("OCRAI_BULK", 1)
+
+    from ocrai import connect_and_read_ocai
+    connect_and_read_ocai()
+
+
+def run_all(args):
+    from pipeline import run_pipeline
+    run_pipeline()
+
+
+def run_watch(args):
+    from watcher import run_daemon
+    run_daemon()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Document OCR and DOB extraction pipeline")
+    parser.add_argument("--profile", action="store_true",
+                        help="cProfile OCR and DOB extraction per document (OCR_PROFILE)")
+    parser.add_argument("--profile-rate", type=float, help="fraction of documents to profile (OCR_PROFILE_SAMPLE_RATE)")
+    parser.add_argument("--profile-dir", help="where profiles are written (OCR_PROFILE_DIR)")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+
+    ingest = subcommands.add_parser("ingest", help="add new uploads to ocr_logs")
+    ingest.set_defaults(handler=run_ingest)
+
+    ocr = subcommands.add_parser("ocr", help="OCR pending ocr_logs rows")
+    ocr.add_argument("--worker", action="store_true", help="keep running and poll for new rows")
+    ocr.add_argument("--workers", type=int, help="number of OCR processes (OCR_WORKERS)")
+    ocr.add_argument("--batch-size", type=int, help="images per predictor call (OCR_BATCH_SIZE)")
+    ocr.add_argument("--engine", choices=["doctr", "adaptive"],
+                     help="adaptive tries Tesseract before doctr (OCR_ENGINE)")
+    ocr.add_argument("--roi", action="store_true",
+                     help="recognise only DOB-relevant text lines, with whole-page fallback (OCR_ROI_MODE)")
+    ocr.set_defaults(handler=run_ocr)
+
+    extract_dob = subcommands.add_parser("extract-dob", help="extract DOBs from OCR'd rows")
+    mode = extract_dob.add_mutually_exclusive_group()
+    mode.add_argument("--async", dest="use_async", action="store_true", help="concurrent requests (OCRAI_ASYNC)")
+    mode.add_argument("--bulk", action="store_true", help="OpenAI Batch API (OCRAI_BULK)")
+    extract_dob.set_defaults(handler=run_extract_dob)
+
+    run_all_parser = subcommands.add_parser("run-all", help="run every stage as one pipeline")
+    run_all_parser.set_defaults(handler=run_all)
+
+    watch = subcommands.add_parser("watch", help="run the pipeline whenever new uploads arrive")
+    watch.set_defaults(handler=run_watch)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    if args.profile:
+        set_env("OCR_PROFILE", 1)
+    set_env("OCR_PROFILE_SAMPLE_RATE", args.profile_rate)
+    set_env("OCR_PROFILE_DIR", args.profile_dir)
+
+    # METRICS_PORT serves /metrics while the command runs; METRICS_TEXTFILE
+    # receives a final snapshot for the node_exporter textfile collector
+    import metrics
+    metrics.start_exporter()
+    try:
+        args.handler(args)
+    finally:
+        metrics.write_textfile()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,401 @@
+import os
+import time
+import uuid
+from mysql.connector import pooling, Error
+import metrics
+
+# Hot-path statements on ocr_logs. Single-row updates run on plain cursors:
+# a prepared cursor costs a prepare and a close round trip per call, and the
+# pool's session reset drops server-side statements whenever a connection is
+# returned, so they cannot be reused across borrows. Bulk updates keep a
+# prepared cursor, where one prepare serves every row
+UPDATE_RESPONSE_DATA_QUERY = """
+UPDATE `ocr_logs`
+SET `response_data` = %s, `ocr_engine` = %s, `read_status` = 'completed',
+    `lease_token` = NULL, `lease_expires_at` = NULL
+WHERE `id` = %s
+"""
+
+UPDATE_DOB_QUERY = """
+UPDATE `ocr_logs`
+SET `dob` = %s, `status` = %s, `lease_token` = NULL, `lease_expires_at` = NULL
+WHERE `id` = %s
+"""
+
+# The pool is created lazily and per process, so forked OCR workers never
+# reuse sockets that belong to their parent
+pool = None
+pool_pid = None
+
+
+def get_pool():
+    """
+    Returns this process's MySQL connection pool, sized by DB_POOL_SIZE.
+    """
+    global pool, pool_pid
+    if pool is None or pool_pid != os.getpid():
+        pool = pooling.MySQLConnectionPool(
+            pool_name=f"ocr_pool_{os.getpid()}",
+            pool_size=int(os.getenv("DB_POOL_SIZE", 5)),
+            pool_reset_session=True,
+            host=os.getenv("DB_HOST"),           # e.g., 'localhost' or the server's IP
+            port=int(os.getenv("DB_PORT", 3306)),
+            user=os.getenv("DB_USERNAME"),       # e.g., 'root'
+            password=os.getenv("DB_PASSWORD"),   # your MySQL password
+            database=os.getenv("DB_DATABASE")    # the database name
+        )
+        pool_pid = os.getpid()
+    return pool
+
+
+def get_connection(timeout=None):
+    """
+    Borrows a health-checked connection from the pool. Closing the connection
+    returns it to the pool.
+
+    Waits up to timeout seconds (DB_POOL_TIMEOUT, default 30) for a free
+    connection before raising PoolError.
+    """
+    if timeout is None:
+        timeout = float(os.getenv("DB_POOL_TIMEOUT", 30))
+
+    with metrics.timed("db", "connect"):
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                connection = get_pool().get_connection()
+                break
+            except pooling.PoolError:
+                if time.monotonic() >= deadline:
+                    raise
+                time.sleep(0.05)
+
+        # Reconnect transparently if the server dropped the idle connection
+        try:
+            connection.ping(reconnect=True, attempts=3, delay=1)
+        except Error:
+            connection.close()
+            raise
+
+    return connection
+
+
+def update_response_data(connection, doc_id, extracted_text, engine=None):
+    """
+    Stores OCR text for an ocr_logs row, with the engine that produced it, and
+    marks it completed. Returns True if the row exists.
+    """
+    cursor = connection.cursor()
+    try:
+        with metrics.timed("ocr", "write_back", doc_id=doc_id):
+            cursor.execute(UPDATE_RESPONSE_DATA_QUERY, (extracted_text, engine, doc_id))
+            connection.commit()
+        return cursor.rowcount > 0
+    finally:
+        cursor.close()
+
+
+def update_dob(connection, file_id, dob, status):
+    """
+    Stores the extracted DOB and status for an ocr_logs row.
+    """
+    cursor = connection.cursor()
+    try:
+        with metrics.timed("dob", "write_back", doc_id=file_id):
+            cursor.execute(UPDATE_DOB_QUERY, (dob, status, file_id))
+            connection.commit()
+    finally:
+        cursor.close()
+
+
+def ensure_ocr_logs_unique_key(connection):
+    """
+    Adds a unique key on ocr_logs (doc_id, user_id) if it is not there yet, so
+    concurrent ingestion runs cannot double-insert a document. Raises if the
+    key cannot be created, since ingestion relies on it to skip duplicates.
+    """
+    cursor = connection.cursor()
+    try:
+        cursor.execute("""
+            SELECT COUNT(*) FROM `information_schema`.`statistics`
+            WHERE `table_schema` = DATABASE() AND `table_name` = 'ocr_logs'
+            AND `index_name` = 'uniq_ocr_logs_doc_user'
+        """)
+        if cursor.fetchone()[0] == 0:
+            try:
+                cursor.execute(
+                    "ALTER TABLE `ocr_logs` ADD UNIQUE KEY `uniq_ocr_logs_doc_user` (`doc_id`, `user_id`)"
+                )
+                print("Added unique key uniq_ocr_logs_doc_user on ocr_logs (doc_id, user_id)")
+            except Error as e:
+                # Usually rows that are already duplicated; show a few so they can be cleaned up
+                cursor.execute("""
+                    SELECT `doc_id`, `user_id`, COUNT(*) FROM `ocr_logs`
+                    GROUP BY `doc_id`, `user_id` HAVING COUNT(*) > 1 LIMIT 10
+                """)
+                duplicates = cursor.fetchall()
+                print(f"Error: cannot add unique key uniq_ocr_logs_doc_user on ocr_logs (doc_id, user_id): {e}")
+                for doc_id, user_id, count in duplicates:
+                    print(f"  doc_id {doc_id}, user_id {user_id} appears {count} times")
+                print("Remove the duplicate ocr_logs rows, then run ingestion again.")
+                raise
+    finally:
+        cursor.close()
+
+
+def update_dobs(connection, rows):
+    """
+    Applies many (dob, status, id) updates to ocr_logs in one transaction.
+    """
+    if not rows:
+        return
+
+    cursor = connection.cursor(prepared=True)
+    try:
+        with metrics.timed("dob", "write_back_bulk", rows=len(rows)):
+            cursor.executemany(UPDATE_DOB_QUERY, rows)
+            connection.commit()
+    finally:
+        cursor.close()
+
+
+def iter_ocr_logs(columns, where, params=(), page_size=None):
+    """
+    Lazily yields ocr_logs rows as dictionaries using keyset pagination on id.
+
+    Only the named columns (plus id) are selected, and each page is fetched on
+    a briefly borrowed pooled connection, so callers can update rows while
+    iterating and memory stays bounded by WORK_FETCH_PAGE_SIZE.
+    """
+    if page_size is None:
+        page_size = int(os.getenv("WORK_FETCH_PAGE_SIZE", 100))
+
+    column_list = ", ".join(f"`{column}`" for column in columns if column != "id")
+    query = f"""
+    SELECT `id`, {column_list} FROM `ocr_logs`
+    WHERE ({where}) AND `id` > %s
+    ORDER BY `id` ASC
+    LIMIT %s
+    """
+
+    last_id = 0
+    while True:
+        connection = get_connection()
+        cursor = connection.cursor(dictionary=True)
+        try:
+            with metrics.timed("db", "query"):
+                cursor.execute(query, (*params, last_id, page_size))
+                rows = cursor.fetchall()
+        finally:
+            cursor.close()
+            connection.close()
+
+        if not rows:
+            return
+
+        last_id = rows[-1]["id"]
+        yield from rows
+
+        if len(rows) < page_size:
+            return
+
+
+# Set once this process has checked that the lease columns exist
+lease_columns_checked = False
+
+
+def ensure_ocr_logs_lease_columns(connection):
+    """
+    Adds the lease_token / lease_expires_at columns used for job claiming if they are missing.
+    """
+    global lease_columns_checked
+    if lease_columns_checked:
+        return
+
+    cursor = connection.cursor()
+    try:
+        cursor.execute("""
+            SELECT `column_name` FROM `information_schema`.`columns`
+            WHERE `table_schema` = DATABASE() AND `table_name` = 'ocr_logs'
+            AND `column_name` IN ('lease_token', 'lease_expires_at')
+        """)
+        existing = {row[0] for row in cursor.fetchall()}
+        if "lease_token" not in existing:
+            cursor.execute("ALTER TABLE `ocr_logs` ADD COLUMN `lease_token` CHAR(36) NULL, ADD INDEX `idx_ocr_logs_lease_token` (`lease_token`)")
+        if "lease_expires_at" not in existing:
+            cursor.execute("ALTER TABLE `ocr_logs` ADD COLUMN `lease_expires_at` DATETIME NULL")
+        lease_columns_checked = True
+    finally:
+        cursor.close()
+
+
+engine_column_checked = False
+
+
+def ensure_ocr_logs_engine_column(connection):
+    """
+    Adds the ocr_engine column that records which OCR engine produced response_data if it is missing.
+    """
+    global engine_column_checked
+    if engine_column_checked:
+        return
+
+    cursor = connection.cursor()
+    try:
+        cursor.execute("""
+            SELECT COUNT(*) FROM `information_schema`.`columns`
+            WHERE `table_schema` = DATABASE() AND `table_name` = 'ocr_logs'
+            AND `column_name` = 'ocr_engine'
+        """)
+        if not cursor.fetchone()[0]:
+            cursor.execute("ALTER TABLE `ocr_logs` ADD COLUMN `ocr_engine` VARCHAR(32) NULL")
+        engine_column_checked = True
+    finally:
+        cursor.close()
+
+
+def claim_ocr_logs(columns, where, params=(), batch_size=None, lease_seconds=None):
+    """
+    Lazily yields ocr_logs rows as dictionaries, atomically claiming them in
+    batches so several workers or hosts never process the same row.
+
+    Each batch is claimed with a single UPDATE ... ORDER BY ... LIMIT that sets
+    a fresh lease token and expiry. Rows whose lease has expired (the worker
+    holding them crashed) are claimable again. Writing a result back through
+    update_response_data / update_dob releases the lease. Each row carries its
+    lease_token so callers can renew_lease right before processing it.
+    """
+    if batch_size is None:
+        batch_size = int(os.getenv("WORK_CLAIM_BATCH_SIZE", 20))
+    if lease_seconds is None:
+        lease_seconds = int(os.getenv("WORK_LEASE_SECONDS", 600))
+
+    column_list = ", ".join(f"`{column}`" for column in columns if column != "id")
+    claim_query = f"""
+    UPDATE `ocr_logs`
+    SET `lease_token` = %s, `lease_expires_at` = NOW() + INTERVAL %s SECOND
+    WHERE ({where}) AND (`lease_token` IS NULL OR `lease_expires_at` < NOW())
+    ORDER BY `id` ASC
+    LIMIT %s
+    """
+    select_query = f"""
+    SELECT `id`, {column_list}, `lease_token` FROM `ocr_logs`
+    WHERE `lease_token` = %s
+    ORDER BY `id` ASC
+    """
+
+    while True:
+        token = str(uuid.uuid4())
+        connection = get_connection()
+        cursor = connection.cursor(dictionary=True)
+        try:
+            ensure_ocr_logs_lease_columns(connection)
+            with metrics.timed("db", "claim"):
+                cursor.execute(claim_query, (token, lease_seconds, *params, batch_size))
+                connection.commit()
+                if cursor.rowcount == 0:
+                    return
+                cursor.execute(select_query, (token,))
+                rows = cursor.fetchall()
+        finally:
+            cursor.close()
+            connection.close()
+
+        yield from rows
+
+
+def claim_row(row_id, where, params=(), lease_seconds=None):
+    """
+    Atomically claims a single ocr_logs row if it still matches where and is
+    not leased by anyone else. Returns True if this process now holds it.
+    """
+    if lease_seconds is None:
+        lease_seconds = int(os.getenv("WORK_LEASE_SECONDS", 600))
+
+    connection = get_connection()
+    cursor = connection.cursor()
+    try:
+        cursor.execute(f"""
+        UPDATE `ocr_logs`
+        SET `lease_token` = %s, `lease_expires_at` = NOW() + INTERVAL %s SECOND
+        WHERE `id` = %s AND ({where}) AND (`lease_token` IS NULL OR `lease_expires_at` < NOW())
+        """, (str(uuid.uuid4()), lease_seconds, row_id, *params))
+        connection.commit()
+        return cursor.rowcount == 1
+    finally:
+        cursor.close()
+        connection.close()
+
+
+def renew_lease(row, lease_seconds=None):
+    """
+    Extends the lease on a claimed row right before it is processed, so rows
+    that waited in a queue are not claimed again by another worker. Returns
+    False if the lease was lost (it expired and someone else claimed the row),
+    in which case the row must be skipped. Rows read without a lease
+    (WORK_LEASES=0) are always processed.
+    """
+    token = row.get("lease_token")
+    if token is None:
+        return True
+    if lease_seconds is None:
+        lease_seconds = int(os.getenv("WORK_LEASE_SECONDS", 600))
+
+    connection = get_connection()
+    cursor = connection.cursor()
+    try:
+        cursor.execute("""
+        UPDATE `ocr_logs` SET `lease_expires_at` = NOW() + INTERVAL %s SECOND
+        WHERE `id` = %s AND `lease_token` = %s
+        """, (lease_seconds, row["id"], token))
+        connection.commit()
+        if cursor.rowcount == 1:
+            return True
+
+        # MySQL reports changed rows, so a renewal within the same second reads as 0
+        cursor.execute("SELECT COUNT(*) FROM `ocr_logs` WHERE `id` = %s AND `lease_token` = %s", (row["id"], token))
+        return cursor.fetchone()[0] == 1
+    finally:
+        cursor.close()
+        connection.close()
+
+
+def count_backlog():
+    """
+    Returns how many ocr_logs rows are waiting for OCR and for DOB extraction.
+    """
+    connection = get_connection()
+    cursor = connection.cursor()
+    try:
+        with metrics.timed("db", "query"):
+            cursor.execute("""
+            SELECT
+                SUM(`read_status` = 'pending'),
+                SUM(`read_status` = 'completed' AND `status` = '0')
+            FROM `ocr_logs`
+            """)
+            ocr_pending, dob_pending = cursor.fetchone()
+        return {"ocr": int(ocr_pending or 0), "dob": int(dob_pending or 0)}
+    finally:
+        cursor.close()
+        connection.close()
+
+
+def fetch_work(columns, where, params=()):
+    """
+    Yields the ocr_logs rows a stage should process: claimed under a lease by
+    default, or a plain keyset scan when WORK_LEASES=0 (single-node setups).
+    """
+    # The write-back statements clear the lease columns and set ocr_engine,
+    # so they must exist in both modes
+    if not (lease_columns_checked and engine_column_checked):
+        connection = get_connection()
+        try:
+            ensure_ocr_logs_lease_columns(connection)
+            ensure_ocr_logs_engine_column(connection)
+        finally:
+            connection.close()
+
+    if os.getenv("WORK_LEASES", "1") == "0":
+        return iter_ocr_logs(columns, where, params)
+    return claim_ocr_logs(columns, where, params)
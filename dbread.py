@@ -1,8 +1,10 @@
 import os
 from dotenv import load_dotenv
-import mysql.connector
 from mysql.connector import Error
+import db
+import metrics
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 
 # Define the path to the .env file relative to the current file's location
 env_path = Path(__file__).resolve().parent / '.env'
@@ -14,13 +16,67 @@ if load_dotenv(dotenv_path=env_path):
 else:
     print("Failed to load environment variables.")
 
+def resolve_file_directory():
+    """
+    Returns FILE_DIRECTORY resolved against the server's base directory, or None if it is not set.
+    """
+    file_directory = os.getenv("FILE_DIRECTORY")  # Directory where files are expected
+    if not file_directory:
+        return None
+
+    # Convert file_directory to a Path object starting from /var/www/html
+    base_directory = Path(__file__).resolve().parent.parent  # Base directory on your server
+    return base_directory / file_directory  # Correctly resolve the full path
+
+
+def build_directory_index(directory):
+    """
+    Walks directory once with os.scandir and returns the set of every file path under it.
+    """
+    index = set()
+    pending = [str(directory)]
+    while pending:
+        current = pending.pop()
+        try:
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        pending.append(entry.path)
+                    else:
+                        index.add(os.path.normpath(entry.path))
+        except OSError as e:
+            print(f"Error scanning {current}: {e}")
+    return index
+
+
+def resolve_existing_files(file_directory, file_paths):
+    """
+    Returns a list of booleans telling whether each path exists.
+
+    FILE_EXISTS_MODE picks the strategy: 'stat' checks each path in turn,
+    'index' walks file_directory once and checks against that listing, and
+    'threads' runs the stat calls on a thread pool (FILE_EXISTS_THREADS).
+    """
+    mode = os.getenv("FILE_EXISTS_MODE", "stat")
+
+    if mode == "index":
+        index = build_directory_index(file_directory)
+        return [os.path.normpath(str(path)) in index for path in file_paths]
+
+    if mode == "threads":
+        with ThreadPoolExecutor(max_workers=int(os.getenv("FILE_EXISTS_THREADS", 32))) as executor:
+            return list(executor.map(os.path.exists, file_paths))
+
+    return [path.exists() for path in file_paths]
+
+
 def connect_and_read():
     connection = None  # Initialize connection before the try block
     cursor = None      # Initialize cursor to ensure it's defined if used in finally block
     try:
         # Fetch APP_URL and FILE_DIRECTORY from environment variables
         app_url = os.getenv("APP_URL")
-        file_directory = os.getenv("FILE_DIRECTORY")  # Directory where files are expected
+        file_directory = resolve_file_directory()
         
         # Check if the environment variables are loaded correctly
         if not app_url:
@@ -30,22 +86,13 @@ def connect_and_read():
             print("Error: FILE_DIRECTORY is not set in the environment variables.")
             return
         
-        # Convert file_directory to a Path object starting from /var/www/html
-        base_directory = Path(__file__).resolve().parent.parent  # Base directory on your server
-        file_directory = base_directory / file_directory  # Correctly resolve the full path
-        
         # Check if file_directory exists
         if not file_directory.exists():
             print(f"Error: The specified file directory does not exist: {file_directory}")
             return
         
-        # Connect to the MySQL database
-        connection = mysql.connector.connect(
-            host=os.getenv("DB_HOST"),           # e.g., 'localhost' or the server's IP
-            user=os.getenv("DB_USERNAME"),       # e.g., 'root'
-            password=os.getenv("DB_PASSWORD"),   # your MySQL password
-            database=os.getenv("DB_DATABASE")    # the database name
-        )
+        # Borrow a connection from the shared pool
+        connection = db.get_connection()
 
         if connection.is_connected():
             print("Connected to the database")
@@ -53,48 +100,68 @@ def connect_and_read():
             # Create a cursor object
             cursor = connection.cursor()
 
-            # Define the query to read data from the avsdocs and users tables
-            query = f"""
-            SELECT `avsdocs`.`id`, `users`.`id` AS user_id, CONCAT('{app_url}', `avsdocs`.`doc_url`) AS doc_url, `avsdocs`.`doc_file_type` FROM `avsdocs` JOIN ( SELECT `user_id`, MAX(`id`) AS latest_id FROM `avsdocs` WHERE `doc_approved` IN ('no', 'not_yet') AND `is_deleted` = 'no' GROUP BY `user_id` ) AS latest_docs ON `avsdocs`.`id` = latest_docs.`latest_id` LEFT JOIN `users` ON `users`.`id` = `avsdocs`.`user_id` WHERE `users`.`age_verified` <> 'yes' ORDER BY `avsdocs`.`id` DESC
+            # Make sure concurrent runs cannot insert the same (doc_id, user_id) twice
+            db.ensure_ocr_logs_unique_key(connection)
+
+            # Define the query to read data from the avsdocs and users tables,
+            # letting the database drop documents that already have an ocr_logs row
+            query = """
+            SELECT `avsdocs`.`id`, `users`.`id` AS user_id, CONCAT(%s, `avsdocs`.`doc_url`) AS doc_url, `avsdocs`.`doc_file_type` FROM `avsdocs` JOIN ( SELECT `user_id`, MAX(`id`) AS latest_id FROM `avsdocs` WHERE `doc_approved` IN ('no', 'not_yet') AND `is_deleted` = 'no' GROUP BY `user_id` ) AS latest_docs ON `avsdocs`.`id` = latest_docs.`latest_id` LEFT JOIN `users` ON `users`.`id` = `avsdocs`.`user_id` LEFT JOIN `ocr_logs` ON `ocr_logs`.`doc_id` = `avsdocs`.`id` AND `ocr_logs`.`user_id` = `users`.`id` WHERE `users`.`age_verified` <> 'yes' AND `ocr_logs`.`id` IS NULL ORDER BY `avsdocs`.`id` DESC
             """
 
-            # Execute the query
-            cursor.execute(query)
+            # Execute the query and fetch all rows
+            with metrics.timed("ingest", "query"):
+                cursor.execute(query, (app_url,))
+                rows = cursor.fetchall()
+
+            # Construct each file path relative to the base directory
+            file_paths = [
+                file_directory / Path(row[2].replace(f'{app_url}/', ''))  # Adjusted replacement pattern
+                for row in rows
+            ]
+
+            # Check which files exist in the specified directory
+            with metrics.timed("ingest", "file_check", files=len(file_paths)):
+                exists = resolve_existing_files(file_directory, file_paths)
 
-            # Fetch all rows from the executed query
-            rows = cursor.fetchall()
+            # Collect the rows whose file exists on disk
+            new_rows = []
+            missing_files = []
+            for row, file_path, found in zip(rows, file_paths, exists):
+                if found:
+                    new_rows.append((row[0], row[1], row[2], str(file_path), row[3], '0'))
+                else:
+                    missing_files.append(file_path)
+
+            # Report missing files once instead of one line per file
+            if missing_files:
+                print(f"Files not found: {len(missing_files)}")
+                for file_path in missing_files[:10]:
+                    print(f"  {file_path}")
+                if len(missing_files) > 10:
+                    print(f"  ... and {len(missing_files) - 10} more")
 
-            # Insert the fetched data into the ocr_logs table if the file exists and the record does not already exist
+            # Insert the new rows with multi-row inserts. The no-op update skips
+            # rows a concurrent run inserted after our SELECT, while any other
+            # error (truncation, NULLs) still fails the insert, unlike IGNORE
             insert_query = """
             INSERT INTO ocr_logs (doc_id, user_id, file_path, file_disk_path, file_type, status)
             VALUES (%s, %s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE id = id
             """
-            
-            check_query = """
-            SELECT COUNT(*) FROM ocr_logs WHERE doc_id = %s AND user_id = %s
-            """
+            batch_size = int(os.getenv("INGEST_INSERT_BATCH_SIZE", 500))
+            inserted = 0
+            with metrics.timed("ingest", "insert", rows=len(new_rows)):
+                for start in range(0, len(new_rows), batch_size):
+                    cursor.executemany(insert_query, new_rows[start:start + batch_size])
+                    inserted += cursor.rowcount
 
-            for row in rows:
-                # Construct the file path relative to the base directory
-                relative_path = row[2].replace(f'{app_url}/', '')  # Adjusted replacement pattern
-                file_path = file_directory / Path(relative_path)  # Correctly resolve the file path
-                
-                # Check if the file exists in the specified directory
-                if file_path.exists():
-                    # Check if the record already exists in ocr_logs
-                    cursor.execute(check_query, (row[0], row[1]))
-                    record_exists = cursor.fetchone()[0] > 0
-                    
-                    if not record_exists:
-                        cursor.execute(insert_query, (row[0], row[1], row[2], str(file_path), row[3], '0'))
-                    else:
-                        print(f"Record already exists for doc_id: {row[0]}, user_id: {row[1]}")
-                else:
-                    print(f"File not found: {file_path}")
+                # Commit all batches as one transaction
+                connection.commit()
 
-            # Commit the transaction
-            connection.commit()
-            print("Data inserted into ocr_logs table")
+            metrics.inc("ocr_pipeline_documents_total", inserted, stage="ingest", outcome="inserted")
+            metrics.inc("ocr_pipeline_documents_total", len(missing_files), stage="ingest", outcome="missing_file")
+            print(f"Data inserted into ocr_logs table: {inserted} new rows, {len(missing_files)} missing files")
 
     except Error as e:
         print(f"Error: {e}")
@@ -103,11 +170,12 @@ def connect_and_read():
         # Close the cursor if it exists
         if cursor:
             cursor.close()
-        # Close the database connection
-        if connection and connection.is_connected():
+        # Return the connection to the pool
+        if connection:
             connection.close()
-            print("Connection closed")
 
-print("Starting connect_and_read...")
-connect_and_read()
-print("connect_and_read completed.")
\ No newline at end of file
+# Run the function when executed as a script
+if __name__ == "__main__":
+    print("Starting connect_and_read...")
+    connect_and_read()
+    print("connect_and_read completed.")
\ No newline at end of file
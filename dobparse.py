@@ -0,0 +1,173 @@
+import os
+import re
+from datetime import date
+
+# Labels that introduce a date of birth on the documents we see, including the
+# OCR misreadings the LLM prompt already mentions ("Dale de naissance",
+# "Fechi de oicimiento") and numbered licence fields such as "3" or "2A"
+DOB_LABEL_PATTERN = re.compile(
+    r"""
+    (?:\b\d{1,2}[A-Z]?\.?\s+)?              # optional field number, e.g. '3 ' or '2A '
+    \b(?:
+        date\s*of\s*birth
+      | birth\s*date
+      | d\.?\s*o\.?\s*b\.?
+      | da[lt]e\s*de\s*naissance
+      | fech[ai]\s*de\s*(?:nac|oic)imiento
+      | geburtsdatum
+      | data\s*di\s*nascita
+      | data\s*de\s*nascimento
+      | fecha\s*nac\.?
+    )(?![A-Za-z])
+    """,
+    re.IGNORECASE | re.VERBOSE,
+)
+
+MONTHS = {
+    "jan": 1, "january": 1, "janv": 1, "janvier": 1, "ene": 1, "enero": 1,
+    "feb": 2, "february": 2, "fev": 2, "fevrier": 2, "février": 2, "febrero": 2,
+    "mar": 3, "march": 3, "mars": 3, "marzo": 3,
+    "apr": 4, "april": 4, "avr": 4, "avril": 4, "abr": 4, "abril": 4,
+    "may": 5, "mai": 5, "mayo": 5,
+    "jun": 6, "june": 6, "juin": 6, "junio": 6,
+    "jul": 7, "july": 7, "juil": 7, "juillet": 7, "julio": 7,
+    "aug": 8, "august": 8, "aout": 8, "août": 8, "ago": 8, "agosto": 8,
+    "sep": 9, "sept": 9, "september": 9, "septembre": 9, "septiembre": 9,
+    "oct": 10, "october": 10, "octobre": 10, "octubre": 10,
+    "nov": 11, "november": 11, "novembre": 11, "noviembre": 11,
+    "dec": 12, "december": 12, "decembre": 12, "décembre": 12, "dic": 12, "diciembre": 12,
+}
+
+MONTH_NAME = r"([A-Za-zéû]{3,10})\.?"
+
+# yyyy-mm-dd and yyyy/mm/dd
+ISO_PATTERN = re.compile(r"\b(\d{4})[-/.](\d{1,2})[-/.](\d{1,2})\b")
+# dd/mm/yyyy, mm/dd/yyyy, dd.mm.yyyy, dd-mm-yyyy
+NUMERIC_PATTERN = re.compile(r"\b(\d{1,2})[-/. ](\d{1,2})[-/. ](\d{4})\b")
+# 12 APR 1987, 12-Apr-1987
+DAY_MONTH_NAME_PATTERN = re.compile(r"\b(\d{1,2})[-/. ]+" + MONTH_NAME + r"[-/.,\s]+(\d{4})\b")
+# APR 12, 1987
+MONTH_NAME_DAY_PATTERN = re.compile(r"\b" + MONTH_NAME + r"[-/. ]+(\d{1,2}),?[-/.\s]+(\d{4})\b")
+
+# Loose match for anything that looks like a date, used to find anchors in OCR text
+DATE_TOKEN_PATTERN = re.compile(
+    r"\b\d{1,4}[-/. ]\d{1,2}[-/. ]\d{2,4}\b|\b\d{1,2}[-/. ]+[A-Za-zéû]{3,10}\.?[-/.,\s]+\d{2,4}\b"
+)
+
+# Which way to read an ambiguous numeric date such as 04/05/1990: 'dmy', 'mdy',
+# or empty to treat it as ambiguous and leave it to the LLM
+AMBIGUOUS_DATE_ORDER = os.getenv("DOB_AMBIGUOUS_DATE_ORDER", "")
+
+# Plausible ages for the holder of an ID document
+MIN_AGE = 10
+MAX_AGE = 120
+
+
+def make_date(year, month, day):
+    """
+    Returns a date if the parts form a plausible date of birth, otherwise None.
+    """
+    try:
+        value = date(int(year), int(month), int(day))
+    except ValueError:
+        return None
+
+    today = date.today()
+    if not (today.year - MAX_AGE <= value.year <= today.year - MIN_AGE):
+        return None
+    return value
+
+
+def find_dates(line):
+    """
+    Returns (date, ambiguous) tuples for every date-like token in a line.
+    """
+    found = []
+
+    for match in ISO_PATTERN.finditer(line):
+        value = make_date(match.group(1), match.group(2), match.group(3))
+        if value:
+            found.append((value, False))
+
+    for match in DAY_MONTH_NAME_PATTERN.finditer(line):
+        month = MONTHS.get(match.group(2).lower())
+        value = month and make_date(match.group(3), month, match.group(1))
+        if value:
+            found.append((value, False))
+
+    for match in MONTH_NAME_DAY_PATTERN.finditer(line):
+        month = MONTHS.get(match.group(1).lower())
+        value = month and make_date(match.group(3), month, match.group(2))
+        if value:
+            found.append((value, False))
+
+    for match in NUMERIC_PATTERN.finditer(line):
+        first, second, year = int(match.group(1)), int(match.group(2)), match.group(3)
+        dmy = make_date(year, second, first)
+        mdy = make_date(year, first, second)
+
+        if dmy and mdy and dmy != mdy:
+            # Both readings are valid, e.g. 04/05/1990
+            if AMBIGUOUS_DATE_ORDER == "dmy":
+                found.append((dmy, False))
+            elif AMBIGUOUS_DATE_ORDER == "mdy":
+                found.append((mdy, False))
+            else:
+                found.append((dmy, True))
+        elif dmy or mdy:
+            found.append((dmy or mdy, False))
+
+    return found
+
+
+def extract_dob(text):
+    """
+    Finds the date of birth in OCR text without calling the LLM.
+
+    Returns (dob, confidence) where dob is a yyyy-mm-dd string or None and
+    confidence is between 0 and 1. A date on the same line as a DOB label
+    scores highest, a date on the line after a label a little lower, and an
+    unlabelled date only scores well if it is the only plausible one in the text.
+    Ambiguous day/month orders are capped at 0.5.
+    """
+    if not text:
+        return None, 0.0
+
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    candidates = []
+
+    for index, line in enumerate(lines):
+        label = DOB_LABEL_PATTERN.search(line)
+        if not label:
+            continue
+
+        # Prefer the text after the label, then the next line
+        same_line = find_dates(line[label.end():]) or find_dates(line)
+        if same_line:
+            candidates.extend((value, ambiguous, 0.95) for value, ambiguous in same_line)
+        elif index + 1 < len(lines):
+            candidates.extend((value, ambiguous, 0.85) for value, ambiguous in find_dates(lines[index + 1]))
+
+    if not candidates:
+        # No label: only trust a date when it is the only plausible one
+        unlabelled = [(value, ambiguous) for line in lines for value, ambiguous in find_dates(line)]
+        distinct = {value for value, _ in unlabelled}
+        if len(distinct) == 1:
+            candidates = [(value, ambiguous, 0.6) for value, ambiguous in unlabelled]
+        elif distinct:
+            # Several dates (issue, expiry, birth); the earliest is most likely the DOB
+            earliest = min(distinct)
+            candidates = [(value, ambiguous, 0.3) for value, ambiguous in unlabelled if value == earliest]
+
+    if not candidates:
+        return None, 0.0
+
+    # Labelled candidates that disagree with each other make the result ambiguous
+    best_value, best_ambiguous, best_confidence = max(candidates, key=lambda c: c[2])
+    confidence = best_confidence
+    if len({value for value, _, _ in candidates}) > 1:
+        confidence = min(confidence, 0.5)
+    if best_ambiguous:
+        confidence = min(confidence, 0.5)
+
+    return best_value.isoformat(), confidence
@@ -0,0 +1,186 @@
+import os
+import sys
+import json
+import time
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Latency buckets in seconds, from fast DB round-trips up to slow OCR and LLM calls
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Set METRICS_JSON_LOGS=1 to emit one JSON line per timed step and event on stderr
+JSON_LOGS = os.getenv("METRICS_JSON_LOGS") == "1"
+
+HELP = {
+    "ocr_pipeline_step_seconds": "Latency of each pipeline stage sub-step.",
+    "ocr_pipeline_documents_total": "Documents handled per stage and outcome.",
+    "ocr_pipeline_queue_depth": "Items waiting in the in-process pipeline queues.",
+    "ocr_pipeline_backlog": "ocr_logs rows waiting for each stage.",
+    "ocr_pipeline_engine_total": "OCR results written back, by the engine that produced them.",
+    "ocr_pipeline_roi_total": "ROI OCR attempts that found a DOB (hit) or fell back to whole pages.",
+    "ocr_pipeline_rate_limited_total": "OpenAI requests that were answered with 429.",
+}
+
+lock = threading.Lock()
+counters = {}
+gauges = {}
+histograms = {}
+
+
+def label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def inc(name, amount=1, **labels):
+    """
+    Adds amount to a counter.
+    """
+    key = (name, label_key(labels))
+    with lock:
+        counters[key] = counters.get(key, 0) + amount
+
+
+def set_gauge(name, value, **labels):
+    """
+    Sets a gauge to value.
+    """
+    with lock:
+        gauges[(name, label_key(labels))] = value
+
+
+def observe(name, value, **labels):
+    """
+    Records a value in a histogram with DEFAULT_BUCKETS.
+    """
+    key = (name, label_key(labels))
+    with lock:
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = {"buckets": [0] * len(DEFAULT_BUCKETS), "sum": 0.0, "count": 0}
+        for index, bound in enumerate(DEFAULT_BUCKETS):
+            if value <= bound:
+                histogram["buckets"][index] += 1
+        histogram["sum"] += value
+        histogram["count"] += 1
+
+
+def log_event(event, **fields):
+    """
+    Writes a structured JSON log line when METRICS_JSON_LOGS=1.
+    """
+    if JSON_LOGS:
+        record = {"ts": round(time.time(), 3), "event": event, **fields}
+        print(json.dumps(record, default=str), file=sys.stderr, flush=True)
+
+
+@contextmanager
+def timed(stage, step, **fields):
+    """
+    Times the enclosed block into ocr_pipeline_step_seconds{stage, step}.
+    Extra fields (e.g. doc_id) only go to the JSON log, never into labels.
+    """
+    start = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        observe("ocr_pipeline_step_seconds", elapsed, stage=stage, step=step)
+        log_event("step", stage=stage, step=step, seconds=round(elapsed, 6), outcome=outcome, **fields)
+
+
+def document_done(stage, outcome, **fields):
+    """
+    Counts one document finishing a stage.
+    """
+    inc("ocr_pipeline_documents_total", stage=stage, outcome=outcome)
+    log_event("document", stage=stage, outcome=outcome, **fields)
+
+
+def format_labels(key, extra=()):
+    labels = list(key) + list(extra)
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+
+def render_prometheus():
+    """
+    Returns every metric in the Prometheus text exposition format.
+    """
+    lines = []
+    with lock:
+        series = [
+            ("counter", counters),
+            ("gauge", gauges),
+        ]
+        for metric_type, values in series:
+            for name in sorted({name for name, _ in values}):
+                lines.append(f"# HELP {name} {HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for (metric, key), value in sorted(values.items()):
+                    if metric == name:
+                        lines.append(f"{name}{format_labels(key)} {value}")
+
+        for name in sorted({name for name, _ in histograms}):
+            lines.append(f"# HELP {name} {HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} histogram")
+            for (metric, key), histogram in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                for bound, count in zip(DEFAULT_BUCKETS, histogram["buckets"]):
+                    lines.append(f"{name}_bucket{format_labels(key, [('le', bound)])} {count}")
+                lines.append(f"{name}_bucket{format_labels(key, [('le', '+Inf')])} {histogram['count']}")
+                lines.append(f"{name}_sum{format_labels(key)} {histogram['sum']}")
+                lines.append(f"{name}_count{format_labels(key)} {histogram['count']}")
+
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile(path=None):
+    """
+    Atomically writes the metrics to METRICS_TEXTFILE for the node_exporter textfile collector.
+    """
+    path = path or os.getenv("METRICS_TEXTFILE")
+    if not path:
+        return
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "w") as f:
+        f.write(render_prometheus())
+    os.replace(temp_path, path)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        payload = render_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+exporter = None
+
+
+def start_exporter(port=None):
+    """
+    Serves /metrics on METRICS_PORT from a background thread, if a port is configured.
+    """
+    global exporter
+    port = port or os.getenv("METRICS_PORT")
+    if not port or exporter is not None:
+        return
+    exporter = ThreadingHTTPServer(("0.0.0.0", int(port)), MetricsHandler)
+    threading.Thread(target=exporter.serve_forever, daemon=True).start()
+    print(f"Serving metrics on :{port}/metrics")
@@ -1,11 +1,16 @@
 import os
 from dotenv import load_dotenv
-import mysql.connector
 from mysql.connector import Error
+import db
 from pathlib import Path
-from openai import OpenAI
-import tiktoken
 from datetime import datetime
+import asyncio
+import time
+import dobparse
+import metrics
+import profiling
+from functools import lru_cache
+import json
 
 # Define the path to the .env file relative to the current file's location
 env_path = Path(__file__).resolve().parent / '.env'
@@ -17,16 +22,49 @@ if load_dotenv(dotenv_path=env_path):
 else:
     print("Failed to load environment variables.")
 
-client = OpenAI(
-    api_key=os.environ.get("OPENAI_API_KEY"),
-)
+# Local extractions at or above this confidence skip the LLM entirely
+DOB_FAST_PATH_MIN_CONFIDENCE = float(os.getenv("DOB_FAST_PATH_MIN_CONFIDENCE", 0.8))
+
+# Token budget and context window for the OCR text sent to the LLM
+DOB_PROMPT_TOKEN_BUDGET = int(os.getenv("DOB_PROMPT_TOKEN_BUDGET", 300))
+DOB_PROMPT_CONTEXT_LINES = int(os.getenv("DOB_PROMPT_CONTEXT_LINES", 2))
+
+# Fast-path counters for the current process
+fast_path_hits = 0
+llm_fallbacks = 0
+
+# openai and tiktoken are imported on first use, so importing this module
+# stays cheap for callers that never reach the LLM stage
+client = None
+
+def get_client():
+    """
+    Returns the process-wide OpenAI client, creating it on first use.
+    OPENAI_BASE_URL can point it at a local mock of the API.
+    """
+    global client
+    if client is None:
+        from openai import OpenAI
+        client = OpenAI(
+            api_key=os.environ.get("OPENAI_API_KEY"),
+            base_url=os.environ.get("OPENAI_BASE_URL"),
+        )
+    return client
+
+@lru_cache(maxsize=None)
+def get_encoding(model):
+    """
+    Returns the tiktoken encoder for a model, resolved once per process.
+    """
+    import tiktoken
+    return tiktoken.encoding_for_model(model)
 
 def count_tokens(messages, model="gpt-4"):
     """
     Counts the number of tokens in a list of messages for the specified model using tiktoken.
     """
-    # Initialize the encoder with the model name
-    encoding = tiktoken.encoding_for_model(model)
+    # Reuse the cached encoder for the model
+    encoding = get_encoding(model)
 
     # Calculate the total tokens
     total_tokens = 0
@@ -37,56 +75,134 @@ def count_tokens(messages, model="gpt-4"):
 
     return total_tokens
 
-def calculate_cost(tokens, model="gpt-4"):
+def calculate_cost(prompt_tokens, completion_tokens=0, model="gpt-4", price_multiplier=1.0):
     """
-    Calculates the cost of the API call based on the token count.
+    Calculates the cost of the API call from its prompt and completion token
+    counts. price_multiplier scales the per-token prices, e.g. for the Batch API discount.
     """
     # Example pricing per 1,000 tokens - update with the latest pricing
     cost_per_1000_tokens = float(os.environ.get("TOKEN_COST", 0.03))  # Use a default value if not set
+    prompt_cost_per_1000 = float(os.environ.get("PROMPT_TOKEN_COST", cost_per_1000_tokens))
+    completion_cost_per_1000 = float(os.environ.get("COMPLETION_TOKEN_COST", cost_per_1000_tokens))
 
     # Calculate the total cost
-    cost = (tokens / 1000) * cost_per_1000_tokens
-    return cost
+    cost = (prompt_tokens / 1000) * prompt_cost_per_1000 + (completion_tokens / 1000) * completion_cost_per_1000
+    return cost * price_multiplier
+
+# Cost rows waiting to be written to ocr_api_cost
+pending_costs = []
+
+# Flush buffered cost rows after this many processed documents
+COST_FLUSH_EVERY = int(os.getenv("COST_FLUSH_EVERY", 50))
+
+def record_usage_cost(file_id, response, model="gpt-4o"):
+    """
+    Buffers the cost of a completed API call, using the usage reported in the response.
+    """
+    usage = response.usage
+    if usage is None:
+        return
+
+    record_cost(file_id, usage.prompt_tokens, usage.completion_tokens, model=model)
+
+def record_cost(file_id, prompt_tokens, completion_tokens, model="gpt-4o", price_multiplier=1.0):
+    """
+    Buffers a cost row for the given token usage.
+    """
+    cost = calculate_cost(prompt_tokens, completion_tokens, model=model, price_multiplier=price_multiplier)
+    print(f"Tokens used for doc_id {file_id}: {prompt_tokens} prompt + {completion_tokens} completion, cost ${cost:.4f}")
 
-def insert_cost_to_db(file_id, cost):
+    created_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    pending_costs.append((file_id, cost, created_at))
+
+def flush_costs(connection):
     """
-    Inserts the cost of the API call into the ocr_api_cost table.
+    Writes all buffered cost rows into the ocr_api_cost table in one batch over the given connection.
     """
+    if not pending_costs:
+        return
+
+    cursor = None
     try:
-        # Connect to the MySQL database
-        connection = mysql.connector.connect(
-            host=os.getenv("DB_HOST"),
-            user=os.getenv("DB_USERNAME"),
-            password=os.getenv("DB_PASSWORD"),
-            database=os.getenv("DB_DATABASE")
-        )
+        cursor = connection.cursor()
 
-        if connection.is_connected():
-            cursor = connection.cursor()
-
-            # Define the query to insert the cost into ocr_api_cost table
-            insert_query = """
-            INSERT INTO `ocr_api_cost` (`file_id`, `cost`, `created_at`) 
-            VALUES (%s, %s, %s)
-            """
-            created_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            cursor.execute(insert_query, (file_id, cost, created_at))
-            connection.commit()
-            print(f"Inserted cost for file_id {file_id} with cost ${cost:.4f}.")
+        # Define the query to insert the cost into ocr_api_cost table
+        insert_query = """
+        INSERT INTO `ocr_api_cost` (`file_id`, `cost`, `created_at`) 
+        VALUES (%s, %s, %s)
+        """
+        cursor.executemany(insert_query, pending_costs)
+        connection.commit()
+        print(f"Inserted {len(pending_costs)} cost rows.")
+        pending_costs.clear()
 
     except Error as e:
+        # Keep the rows buffered so the next flush can retry them
         print(f"Error inserting cost: {e}")
 
     finally:
-        if connection and connection.is_connected():
+        if cursor:
             cursor.close()
-            connection.close()
 
-def extract_dob_from_text(text, file_id):
+def compact_ocr_text(text, file_id, model="gpt-4o"):
     """
-    Sends extracted text to GPT-4 to identify the DOB and calculates the cost of the request.
+    Keeps only the lines around DOB labels and date-like tokens, up to the
+    prompt token budget. Falls back to the full text when nothing matches or
+    the tokenizer is unavailable.
     """
-    messages = [
+    try:
+        encoding = get_encoding(model)
+    except Exception as e:
+        # Missing tiktoken or an encoder file that cannot be downloaded
+        # should cost tokens, not the document
+        print(f"Error loading tokenizer, sending full text for doc_id {file_id}: {e}")
+        return text
+    lines = text.splitlines()
+
+    # Label lines are the strongest anchors, so their windows are added first
+    label_anchors = [i for i, line in enumerate(lines) if dobparse.DOB_LABEL_PATTERN.search(line)]
+    date_anchors = [i for i, line in enumerate(lines)
+                    if i not in label_anchors and dobparse.DATE_TOKEN_PATTERN.search(line)]
+    if not label_anchors and not date_anchors:
+        return text
+
+    keep = set()
+    used_tokens = 0
+    for anchor in label_anchors + date_anchors:
+        window = range(max(0, anchor - DOB_PROMPT_CONTEXT_LINES),
+                       min(len(lines), anchor + DOB_PROMPT_CONTEXT_LINES + 1))
+        new_lines = [i for i in window if i not in keep]
+        window_tokens = sum(len(encoding.encode(lines[i])) + 1 for i in new_lines)
+        if not keep and window_tokens > DOB_PROMPT_TOKEN_BUDGET:
+            # Even the strongest window is over budget: keep the anchor line
+            # and as much context as fits, nearest lines (and those below) first
+            for i in sorted(new_lines, key=lambda i: (abs(i - anchor), i < anchor)):
+                line_tokens = encoding.encode(lines[i])
+                if used_tokens + len(line_tokens) + 1 <= DOB_PROMPT_TOKEN_BUDGET:
+                    keep.add(i)
+                    used_tokens += len(line_tokens) + 1
+                elif i == anchor:
+                    lines[i] = encoding.decode(line_tokens[:max(0, DOB_PROMPT_TOKEN_BUDGET - 1)])
+                    keep.add(i)
+                    used_tokens = DOB_PROMPT_TOKEN_BUDGET
+            break
+        if keep and used_tokens + window_tokens > DOB_PROMPT_TOKEN_BUDGET:
+            break
+        keep.update(new_lines)
+        used_tokens += window_tokens
+
+    compacted = "\n".join(lines[i] for i in sorted(keep))
+
+    full_tokens = len(encoding.encode(text))
+    compacted_tokens = len(encoding.encode(compacted))
+    print(f"Compacted prompt text for doc_id {file_id}: {full_tokens} -> {compacted_tokens} tokens")
+    return compacted
+
+def build_dob_messages(text):
+    """
+    Builds the chat messages asking the model for the DOB in the given OCR text.
+    """
+    return [
         {
             "role": "system",
             "content": "You are a helpful assistant that extracts date of birth from the provided text.",
@@ -96,108 +212,531 @@ def extract_dob_from_text(text, file_id):
             "content": f"Extract the date of birth or DOB or Date of birth or Dale de naissance Fechi de oicimiento from the following text:\n\n{text} in yyyy-mm-dd format only and do not send any other data along with the DOB.In the text there may be text like '2A DATE OF BIRTH' ",
         },
     ]
-    
-    try:
-        # Count the tokens for the messages
-        tokens = count_tokens(messages, model="gpt-4o")
-        cost = calculate_cost(tokens, model="gpt-4o")
 
-        print(f"Tokens used: {tokens}")
-        print(f"Estimated cost: ${cost:.4f}")
+def parse_dob_response(response):
+    """
+    Returns the DOB from a chat completion response, or None if it is not in yyyy-mm-dd format.
+    """
+    return parse_dob_content(response.choices[0].message.content)
 
-        # Insert the cost into the database
-        insert_cost_to_db(file_id, cost)
+def parse_dob_content(content):
+    """
+    Returns the DOB from the model's message content, or None if it is not in yyyy-mm-dd format.
+    """
+    # Extract DOB from the response
+    dob = (content or "").strip()
+    # Check if the extracted DOB matches the YYYY-MM-DD format
+    if dob and len(dob) == 10 and dob[4] == '-' and dob[7] == '-':
+        print(f"Extracted DOB: {dob}")
+        return dob
+
+    print("Error: DOB extraction failed or format is incorrect.")
+    return None
+
+def dob_status(dob):
+    """
+    Returns the ocr_logs status for a DOB extraction result.
+    """
+    # Determine the appropriate status based on the result of DOB extraction
+    if dob:
+        return 'dob_extracted'
+    return "Error: Failed to extract DOB"
+
+def extract_dob_locally(text, file_id):
+    """
+    Runs the local DOB parser and returns its result when it is confident
+    enough, otherwise None so the caller falls through to the LLM.
+    """
+    global fast_path_hits, llm_fallbacks
+    with metrics.timed("dob", "local_parse", doc_id=file_id):
+        dob, confidence = dobparse.extract_dob(text)
+
+    if dob and confidence >= DOB_FAST_PATH_MIN_CONFIDENCE:
+        fast_path_hits += 1
+        metrics.document_done("dob", "fast_path", doc_id=file_id)
+        print(f"Extracted DOB locally for doc_id {file_id}: {dob} (confidence {confidence:.2f})")
+        return dob
+
+    llm_fallbacks += 1
+    return None
+
+def print_fast_path_stats():
+    """
+    Prints how many documents the local DOB parser answered without the LLM.
+    """
+    total = fast_path_hits + llm_fallbacks
+    if total:
+        print(f"DOB fast path: {fast_path_hits}/{total} documents ({fast_path_hits / total:.0%}) skipped the LLM")
+
+@profiling.profiled("dob", "file_id")
+def extract_dob_from_text(text, file_id):
+    """
+    Identifies the DOB locally when possible, otherwise sends the extracted text
+    to GPT-4 and buffers the cost of the request.
+    """
+    dob = extract_dob_locally(text, file_id)
+    if dob:
+        return dob
+
+    try:
+        messages = build_dob_messages(compact_ocr_text(text, file_id))
 
         # Send request to OpenAI API
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=messages,
-        )
-        
-        # Extract DOB from the response
-        dob = response.choices[0].message.content.strip()
-        # Check if the extracted DOB matches the YYYY-MM-DD format
-        if dob and len(dob) == 10 and dob[4] == '-' and dob[7] == '-':
-            print(f"Extracted DOB: {dob}")
-            return dob
-
-        print("Error: DOB extraction failed or format is incorrect.")
+        with metrics.timed("dob", "llm_call", doc_id=file_id):
+            response = get_client().chat.completions.create(
+                model="gpt-4o",
+                messages=messages,
+            )
+
+        record_usage_cost(file_id, response)
+        dob = parse_dob_response(response)
+        metrics.document_done("dob", "llm" if dob else "failed", doc_id=file_id)
+        return dob
+
+    except Exception as e:
+        print(f"Error with OpenAI API: {e}")
+        metrics.document_done("dob", "failed", doc_id=file_id)
         return None
 
+class TokenBucket:
+    """
+    Async token bucket limiting request starts to rate per second with bursts up to capacity.
+    A 429 response can pause the whole bucket until its Retry-After has passed.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+
+                # Refill for the time elapsed since the last acquire
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+def retry_after_seconds(error, default):
+    """
+    Reads the Retry-After header of a rate limit error, falling back to default.
+    """
+    try:
+        return float(error.response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return default
+
+async def extract_dob_from_text_async(async_client, bucket, text, file_id):
+    """
+    Async variant of extract_dob_from_text that waits on the token bucket and
+    retries 429 responses after their Retry-After delay.
+    """
+    from openai import RateLimitError
+
+    max_retries = int(os.getenv("OPENAI_MAX_RETRIES", 5))
+
+    try:
+        messages = build_dob_messages(compact_ocr_text(text, file_id))
+        for attempt in range(max_retries + 1):
+            await bucket.acquire()
+            try:
+                with metrics.timed("dob", "llm_call", doc_id=file_id):
+                    response = await async_client.chat.completions.create(
+                        model="gpt-4o",
+                        messages=messages,
+                    )
+                record_usage_cost(file_id, response)
+                dob = parse_dob_response(response)
+                metrics.document_done("dob", "llm" if dob else "failed", doc_id=file_id)
+                return dob
+            except RateLimitError as e:
+                metrics.inc("ocr_pipeline_rate_limited_total", stage="dob")
+                if attempt == max_retries:
+                    raise
+                delay = retry_after_seconds(e, default=2 ** attempt)
+                print(f"Rate limited on doc_id {file_id}, retrying in {delay:.1f}s")
+                bucket.pause(delay)
+
     except Exception as e:
         print(f"Error with OpenAI API: {e}")
+        metrics.document_done("dob", "failed", doc_id=file_id)
         return None
 
+async def extract_dobs_async(rows, connection, on_result=None):
+    """
+    Extracts DOBs for (file_id, text) rows with a bounded number of requests in
+    flight, writing each result back as soon as it completes and passing it
+    to on_result(file_id, dob) if given.
+
+    rows is consumed lazily, one row per free slot, so claimed rows are not
+    left waiting behind the whole backlog while their leases run out. Rows are
+    pulled on a worker thread, so rows may block (a database cursor, a
+    pipeline queue) without stalling the requests already in flight. Because
+    results are written back while the next row is being pulled, rows must not
+    use connection itself (give resolve_locally a connection of its own).
+    """
+    max_in_flight = int(os.getenv("OPENAI_MAX_IN_FLIGHT", 8))
+    bucket = TokenBucket(
+        rate=float(os.getenv("OPENAI_REQUESTS_PER_SECOND", 5)),
+        capacity=int(os.getenv("OPENAI_BURST", max_in_flight)),
+    )
+
+    # Retries are handled here so Retry-After also throttles the other requests
+    from openai import AsyncOpenAI
+    async_client = AsyncOpenAI(
+        api_key=os.environ.get("OPENAI_API_KEY"),
+        base_url=os.environ.get("OPENAI_BASE_URL"),
+        max_retries=0,
+    )
+
+    async def extract(file_id, text):
+        return file_id, await extract_dob_from_text_async(async_client, bucket, text, file_id)
+
+    written = 0
+
+    def write_back(tasks):
+        nonlocal written
+        for task in tasks:
+            file_id, dob = task.result()
+            db.update_dob(connection, file_id, dob if dob else '', dob_status(dob))
+            print(f"Updated record for doc_id {file_id}.")
+            if on_result:
+                on_result(file_id, dob)
+            written += 1
+            if written % COST_FLUSH_EVERY == 0:
+                flush_costs(connection)
+
+    rows = iter(rows)
+    try:
+        in_flight = set()
+        fetch = None
+        exhausted = False
+        while in_flight or not exhausted:
+            # Wait for the next row and the requests in flight together, so
+            # answers are written back (and their leases released) as soon as
+            # they arrive even while the next row is slow to show up
+            if fetch is None and not exhausted and len(in_flight) < max_in_flight:
+                fetch = asyncio.create_task(asyncio.to_thread(next, rows, None))
+            waiting = (in_flight | {fetch}) if fetch else in_flight
+            done, _ = await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+
+            if fetch in done:
+                row = fetch.result()
+                fetch = None
+                if row is None:
+                    exhausted = True
+                else:
+                    file_id, text = row
+                    in_flight.add(asyncio.create_task(extract(file_id, text)))
+
+            finished = done & in_flight
+            in_flight -= finished
+            write_back(finished)
+    finally:
+        flush_costs(connection)
+        await async_client.close()
+
+def resolve_locally(rows, connection, on_result=None):
+    """
+    Answers confident documents with the local parser and lazily yields the
+    (file_id, text) pairs that still need the LLM. Local answers are passed
+    to on_result(file_id, dob) if given.
+    """
+    for row in rows:
+        if not db.renew_lease(row):
+            print(f"Lease on doc_id {row['id']} was lost, skipping it.")
+            continue
+        dob = extract_dob_locally(row["response_data"], row["id"])
+        if dob:
+            db.update_dob(connection, row["id"], dob, dob_status(dob))
+            if on_result:
+                on_result(row["id"], dob)
+        else:
+            yield row["id"], row["response_data"]
+
+# Where bulk-mode batch files and the resume state are kept
+BATCH_DIR = Path(os.getenv("OCRAI_BATCH_DIR", str(Path(__file__).resolve().parent / "batches")))
+BATCH_STATE_FILE = BATCH_DIR / "batch_state.json"
+BATCH_TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+# Batch API requests are billed at a discount to the synchronous per-token prices
+BATCH_PRICE_MULTIPLIER = float(os.getenv("OPENAI_BATCH_PRICE_MULTIPLIER", 0.5))
+
+def write_batch_state(state):
+    """
+    Atomically replaces the bulk-mode resume state.
+    """
+    temp_path = BATCH_STATE_FILE.with_suffix(".tmp")
+    temp_path.write_text(json.dumps(state))
+    temp_path.replace(BATCH_STATE_FILE)
+
+# Per-batch limits of the Batch API (50,000 requests, 200 MB input file);
+# larger backlogs are split over several batches
+BATCH_MAX_REQUESTS = int(os.getenv("OPENAI_BATCH_MAX_REQUESTS", 50000))
+BATCH_MAX_BYTES = int(os.getenv("OPENAI_BATCH_MAX_BYTES", 190 * 1024 * 1024))
+
+def read_batch_state():
+    """
+    Loads the bulk-mode resume state: {"batches": [entry, ...]}, one entry per
+    submitted batch with its input_file_id, batch_id and file_ids. A state
+    file from before backlogs were split holds a single entry.
+    """
+    state = json.loads(BATCH_STATE_FILE.read_text())
+    if "batches" not in state:
+        state = {"batches": [state]}
+    return state
+
+def create_dob_batch(state, entry):
+    """
+    Creates the batch for an entry's uploaded input file and records its id in the state file.
+    """
+    batch = get_client().batches.create(
+        input_file_id=entry["input_file_id"],
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+    )
+    entry["batch_id"] = batch.id
+    write_batch_state(state)
+    return entry
+
+def reconcile_dob_batch(state, entry):
+    """
+    Finishes a submission interrupted between uploading the input file and
+    recording the batch id: reuses a batch already created for the input file,
+    otherwise creates it now.
+    """
+    for batch in get_client().batches.list(limit=100):
+        if batch.input_file_id == entry["input_file_id"]:
+            print(f"Found batch {batch.id} for input file {entry['input_file_id']}.")
+            entry["batch_id"] = batch.id
+            write_batch_state(state)
+            return entry
+
+    print(f"No batch found for input file {entry['input_file_id']}, creating it.")
+    return create_dob_batch(state, entry)
+
+def write_batch_input_files(rows):
+    """
+    Writes a JSONL request per (file_id, text) row, starting a new file before
+    one would exceed BATCH_MAX_REQUESTS or BATCH_MAX_BYTES. Lazily yields
+    (input_path, file_ids) for each finished file.
+    """
+    BATCH_DIR.mkdir(parents=True, exist_ok=True)
+    stamp = datetime.now().strftime('%Y%m%d%H%M%S')
+    part = 0
+    f = None
+    file_ids = []
+    size = 0
+
+    for file_id, text in rows:
+        request = {
+            "custom_id": str(file_id),
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {"model": "gpt-4o", "messages": build_dob_messages(compact_ocr_text(text, file_id))},
+        }
+        line = (json.dumps(request) + "\n").encode()
+
+        if f and (len(file_ids) >= BATCH_MAX_REQUESTS or size + len(line) > BATCH_MAX_BYTES):
+            f.close()
+            yield input_path, file_ids
+            f = None
+        if f is None:
+            part += 1
+            input_path = BATCH_DIR / f"dob_batch_{stamp}_{part}.jsonl"
+            f = open(input_path, "wb")
+            file_ids = []
+            size = 0
+
+        f.write(line)
+        file_ids.append(file_id)
+        size += len(line)
+
+    if f:
+        f.close()
+        yield input_path, file_ids
+
+def submit_dob_batch(rows, connection):
+    """
+    Submits (file_id, text) rows as one or more batches within the Batch API
+    limits. Each input file is recorded in the state file before its batch is
+    created, so a restarted process can always find or finish the submission
+    instead of sending the same rows again.
+    """
+    state = {"batches": []}
+    for input_path, file_ids in write_batch_input_files(rows):
+        with open(input_path, "rb") as f:
+            input_file = get_client().files.create(file=f, purpose="batch")
+
+        entry = {"input_file_id": input_file.id, "batch_id": None, "file_ids": file_ids}
+        state["batches"].append(entry)
+        write_batch_state(state)
+
+        # Take the rows out of the pending set so other runs do not resend them
+        db.update_dobs(connection, [('', 'batch_pending', file_id) for file_id in file_ids])
+
+        create_dob_batch(state, entry)
+        print(f"Submitted batch {entry['batch_id']} with {len(file_ids)} requests.")
+    return state
+
+def apply_dob_batch(batch, entry, connection):
+    """
+    Downloads a finished batch's output and applies every result to ocr_logs in bulk.
+    Documents without a usable answer are marked as failed.
+    """
+    results = {}
+    if batch.output_file_id:
+        output = get_client().files.content(batch.output_file_id).text
+        for line in output.splitlines():
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            file_id = int(item["custom_id"])
+            response = item.get("response") or {}
+            if response.get("status_code") != 200:
+                continue
+
+            body = response["body"]
+            usage = body.get("usage")
+            if usage:
+                record_cost(file_id, usage["prompt_tokens"], usage["completion_tokens"],
+                            price_multiplier=BATCH_PRICE_MULTIPLIER)
+            results[file_id] = parse_dob_content(body["choices"][0]["message"]["content"])
+
+    updates = []
+    for file_id in entry["file_ids"]:
+        dob = results.get(file_id)
+        updates.append((dob if dob else '', dob_status(dob), file_id))
+
+    db.update_dobs(connection, updates)
+    flush_costs(connection)
+    print(f"Applied batch {batch.id}: {sum(1 for dob in results.values() if dob)}/{len(updates)} DOBs extracted.")
+
+def run_dob_batch(rows, connection):
+    """
+    Bulk mode: submits pending rows through the OpenAI Batch API, or resumes
+    the batches recorded in the state file, then polls until each finishes and
+    applies its results.
+    """
+    if BATCH_STATE_FILE.exists():
+        state = read_batch_state()
+        for entry in state["batches"]:
+            if not entry.get("batch_id"):
+                reconcile_dob_batch(state, entry)
+        print(f"Resuming {len(state['batches'])} batches.")
+    else:
+        # Rows are claimed as the input files are written, and leave the
+        # claimed set (batch_pending) as soon as their batch is submitted
+        state = submit_dob_batch(resolve_locally(rows, connection), connection)
+        print_fast_path_stats()
+        if not state["batches"]:
+            return
+
+    poll_interval = float(os.getenv("OCRAI_BATCH_POLL_INTERVAL", 60))
+    while True:
+        waiting = [entry for entry in state["batches"] if not entry.get("applied")]
+        if not waiting:
+            break
+
+        for entry in waiting:
+            batch = get_client().batches.retrieve(entry["batch_id"])
+            if batch.status not in BATCH_TERMINAL_STATUSES:
+                continue
+            if batch.status == "completed":
+                apply_dob_batch(batch, entry, connection)
+            else:
+                # Put the rows back in the pending set so the next run retries them
+                print(f"Batch {batch.id} ended as {batch.status}, returning its rows to pending.")
+                db.update_dobs(connection, [('', '0', file_id) for file_id in entry["file_ids"]])
+            # Recorded so a restart does not apply the same batch twice
+            entry["applied"] = True
+            write_batch_state(state)
+
+        if any(not entry.get("applied") for entry in state["batches"]):
+            print(f"Waiting on {sum(1 for entry in state['batches'] if not entry.get('applied'))} batches, "
+                  f"checking again in {poll_interval:.0f}s")
+            time.sleep(poll_interval)
+
+    BATCH_STATE_FILE.unlink()
+
+# Columns the DOB stage needs from ocr_logs, and which rows still need a DOB
+OCRAI_WORK_COLUMNS = ("id", "response_data")
+OCRAI_WORK_FILTER = "`read_status` = 'completed' AND `status` = '0'"
+
 def connect_and_read_ocai():
     connection = None  # Initialize connection before the try block
-    cursor = None      # Initialize cursor to ensure it's defined if used in finally block
 
     try:
-        # Connect to the MySQL database
-        connection = mysql.connector.connect(
-            host=os.getenv("DB_HOST"),
-            user=os.getenv("DB_USERNAME"),
-            password=os.getenv("DB_PASSWORD"),
-            database=os.getenv("DB_DATABASE")
-        )
+        # Borrow a connection from the shared pool for the write-backs
+        connection = db.get_connection()
 
         if connection.is_connected():
             print("Connected to the database")
 
-            # Create a cursor object
-            cursor = connection.cursor()
-
-            # Define the query to read data from the ocr_logs table
-            query = """
-            SELECT * FROM `ocr_logs` WHERE `read_status`='completed' ORDER BY `doc_id` ASC
-            """
-
-            # Execute the query
-            cursor.execute(query)
-
-            # Fetch all rows from the executed query
-            rows = cursor.fetchall()
-
-            for row in rows:
-                # Check if status is '0' before extracting DOB
-                if row[5] == '0':  # Assuming the status is in the 6th column (index 5)
-                    extracted_text = row[3]
-                    
-                    file_id = row[0]  # Assuming the first column is the file ID
-                    dob = extract_dob_from_text(extracted_text, file_id)
-                    
-                    # Determine the appropriate status based on the result of DOB extraction
-                    if dob:
-                        status = 'dob_extracted'
-                    else:
-                        status = "Error: Failed to extract DOB"
-
-                    # Update the record in the ocr_logs table
-                    update_query = """
-                    UPDATE `ocr_logs` 
-                    SET `dob` = %s, `status` = %s
-                    WHERE `id` = %s
-                    """
-                    cursor.execute(update_query, (dob if dob else '', status, file_id))
-                    connection.commit()
-                    print(f"Updated record for doc_id {file_id}.")
-                    
-                else:
-                    print(f"Skipping doc_id {row[0]} with status {row[5]}.")
+            # Claim only the rows still waiting for a DOB, batch by batch
+            rows = db.fetch_work(OCRAI_WORK_COLUMNS, OCRAI_WORK_FILTER)
+
+            # Set OCRAI_BULK=1 to send everything through the Batch API
+            if os.getenv("OCRAI_BULK") == "1":
+                run_dob_batch(rows, connection)
+                return
+
+            # Set OCRAI_ASYNC=1 to run the requests concurrently
+            if os.getenv("OCRAI_ASYNC") == "1":
+                # Answer confident documents locally and only queue the rest for the LLM;
+                # local answers are written on their own connection, since rows are
+                # pulled while the LLM answers are being written back
+                local_connection = db.get_connection()
+                try:
+                    pending = resolve_locally(rows, local_connection)
+                    asyncio.run(extract_dobs_async(pending, connection))
+                finally:
+                    local_connection.close()
+                print_fast_path_stats()
+                return
+
+            for index, row in enumerate(rows, start=1):
+                # Write buffered cost rows at the end of each chunk
+                if index % COST_FLUSH_EVERY == 0:
+                    flush_costs(connection)
+
+                file_id = row["id"]
+                if not db.renew_lease(row):
+                    print(f"Lease on doc_id {file_id} was lost, skipping it.")
+                    continue
+                dob = extract_dob_from_text(row["response_data"], file_id)
+
+                # Update the record in the ocr_logs table
+                db.update_dob(connection, file_id, dob if dob else '', dob_status(dob))
+                print(f"Updated record for doc_id {file_id}.")
+
+            flush_costs(connection)
+            print_fast_path_stats()
 
     except Error as e:
         print(f"Error: {e}")
 
     finally:
-        # Close the cursor if it exists
-        if cursor:
-            cursor.close()
-        # Close the database connection
-        if connection and connection.is_connected():
+        # Return the connection to the pool
+        if connection:
             connection.close()
-            print("Connection closed")
 
-# Uncomment these lines to run the main function
-print("Starting connect_and_read_ocai...")
-connect_and_read_ocai()
-print("connect_and_read_ocai completed.")
+# Run the main function when executed as a script
+if __name__ == "__main__":
+    print("Starting connect_and_read_ocai...")
+    connect_and_read_ocai()
+    print("connect_and_read_ocai completed.")
@@ -0,0 +1,127 @@
+import os
+import sqlite3
+import hashlib
+import time
+from pathlib import Path
+
+# On-disk location and size bound of the OCR result cache
+CACHE_PATH = os.getenv("OCR_CACHE_PATH", str(Path(__file__).resolve().parent / "ocr_cache.sqlite3"))
+CACHE_MAX_ENTRIES = int(os.getenv("OCR_CACHE_MAX_ENTRIES", 10000))
+
+# Set OCR_CACHE_ENABLED=0 to always run OCR
+CACHE_ENABLED = os.getenv("OCR_CACHE_ENABLED", "1") == "1"
+
+# Hit/miss counters for the current process
+hits = 0
+misses = 0
+
+# The sqlite connection is opened lazily and per process, so forked OCR
+# workers never share a handle with their parent
+connection = None
+connection_pid = None
+
+
+def get_connection():
+    """
+    Returns this process's connection to the cache database, creating the
+    table on first use and adding the engine column to caches created before it.
+    """
+    global connection, connection_pid
+    if connection is None or connection_pid != os.getpid():
+        connection = sqlite3.connect(CACHE_PATH, timeout=30)
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS ocr_result_cache (
+                cache_key TEXT PRIMARY KEY,
+                response_data TEXT NOT NULL,
+                engine TEXT,
+                last_used REAL NOT NULL
+            )
+        """)
+        columns = {row[1] for row in connection.execute("PRAGMA table_info(ocr_result_cache)")}
+        if "engine" not in columns:
+            connection.execute("ALTER TABLE ocr_result_cache ADD COLUMN engine TEXT")
+        connection.execute(
+            "CREATE INDEX IF NOT EXISTS idx_ocr_result_cache_last_used ON ocr_result_cache (last_used)"
+        )
+        connection.commit()
+        connection_pid = os.getpid()
+    return connection
+
+
+def cache_key(file_path, engine, model_version):
+    """
+    Builds a cache key from a digest of the file bytes plus the OCR engine and model version.
+    Returns None if the file cannot be read.
+    """
+    if not CACHE_ENABLED:
+        return None
+
+    digest = hashlib.sha256()
+    try:
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+    except OSError as e:
+        print(f"Error hashing {file_path} for the OCR cache: {e}")
+        return None
+
+    return f"{digest.hexdigest()}:{engine}:{model_version}"
+
+
+def get_cached_text(key):
+    """
+    Returns (text, engine) for a cached OCR result, or None on a miss. engine
+    is the OCR engine that produced the text, or None for entries cached
+    before engines were recorded.
+    """
+    global hits, misses
+    if key is None:
+        return None
+
+    db = get_connection()
+    row = db.execute(
+        "SELECT response_data, engine FROM ocr_result_cache WHERE cache_key = ?", (key,)
+    ).fetchone()
+
+    if row is None:
+        misses += 1
+        return None
+
+    # Touch the entry so eviction is least-recently-used
+    db.execute("UPDATE ocr_result_cache SET last_used = ? WHERE cache_key = ?", (time.time(), key))
+    db.commit()
+    hits += 1
+    return row[0], row[1]
+
+
+def store_cached_text(key, text, engine):
+    """
+    Stores OCR text and the engine that produced it under a key, and evicts
+    the least recently used entries beyond the size bound.
+    """
+    if key is None or not text or not text.strip():
+        return
+
+    db = get_connection()
+    db.execute(
+        "INSERT OR REPLACE INTO ocr_result_cache (cache_key, response_data, engine, last_used) VALUES (?, ?, ?, ?)",
+        (key, text, engine, time.time()),
+    )
+    db.execute("""
+        DELETE FROM ocr_result_cache WHERE cache_key IN (
+            SELECT cache_key FROM ocr_result_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?
+        )
+    """, (CACHE_MAX_ENTRIES,))
+    db.commit()
+
+
+def cache_stats():
+    """
+    Returns the hit/miss counters for this process.
+    """
+    total = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": hits / total if total else 0.0,
+    }
@@ -1,13 +1,22 @@
 import os
 from dotenv import load_dotenv
-import mysql.connector
 from mysql.connector import Error
-from doctr.models import ocr_predictor
-from doctr.io import DocumentFile
-import PyPDF2
-import pdfplumber
+import db
 from pathlib import Path
 from PIL import Image, ExifTags
+import ocrcache
+import dobparse
+import metrics
+import profiling
+import time
+import resource
+import multiprocessing
+import queue
+import threading
+from importlib import metadata
+import itertools
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
 
 # Define the path to the .env file relative to the current file's location
 env_path = Path(__file__).resolve().parent / '.env'
@@ -20,17 +29,97 @@ if load_dotenv(dotenv_path=env_path):
 else:
     print("Failed to load environment variables.")
 
+# Resolution used to rasterise image-only PDF pages for OCR, and how many
+# rasterised pages may wait for the predictor at once
+PDF_OCR_DPI = int(os.getenv("PDF_OCR_DPI", 200))
+PDF_RASTER_QUEUE_SIZE = int(os.getenv("PDF_RASTER_QUEUE_SIZE", 2))
+
+# OCR_ENGINE=adaptive runs a fast Tesseract pass on images first and only
+# escalates to doctr when the result is low-confidence or has no confident DOB
+OCR_ENGINE = os.getenv("OCR_ENGINE", "doctr")
+FAST_OCR_MIN_CONFIDENCE = float(os.getenv("OCR_FAST_MIN_CONFIDENCE", 70))
+FAST_OCR_MIN_DOB_CONFIDENCE = float(os.getenv("OCR_FAST_MIN_DOB_CONFIDENCE", 0.8))
+
+# Documents accepted from the fast pass vs sent on to doctr in this process
+fast_engine_hits = 0
+fast_engine_escalations = 0
+
+# OCR_ROI_MODE=1 runs full recognition only on text lines near a DOB label or
+# shaped like a date, found with a cheap recognition model, and falls back to
+# whole-page recognition when that yields no confident DOB
+ROI_MODE = os.getenv("OCR_ROI_MODE") == "1"
+ROI_CHEAP_RECO_ARCH = os.getenv("OCR_ROI_CHEAP_RECO_ARCH", "crnn_mobilenet_v3_small")
+# Lines after a DOB label that are also recognised, for dates printed below it
+ROI_LINES_AFTER_LABEL = int(os.getenv("OCR_ROI_LINES_AFTER_LABEL", 1))
+# A DOB read from the ROI lines with lower dobparse confidence than this (an
+# unlabelled or ambiguous date) sends the document to whole-page recognition
+ROI_MIN_DOB_CONFIDENCE = float(os.getenv("OCR_ROI_MIN_DOB_CONFIDENCE", FAST_OCR_MIN_DOB_CONFIDENCE))
+
+# doctr, torch, numpy and pdfplumber are imported inside the functions that use
+# them, so importing this module stays cheap for callers that never run OCR
+
+# The doctr predictor is expensive to build (network construction plus weight
+# loading), so it is created once per process and reused for every document
+predictor = None
+model_load_seconds = None
+
+def get_predictor():
+    """
+    Returns the process-wide OCR predictor, loading it on first use.
+    """
+    global predictor, model_load_seconds
+    if predictor is None:
+        start = time.perf_counter()
+        from doctr.models import ocr_predictor
+        predictor = ocr_predictor(pretrained=True)
+        model_load_seconds = time.perf_counter() - start
+        print(f"OCR model loaded in {model_load_seconds:.2f}s")
+    return predictor
+
+# Low-cost recogniser for the ROI pass, loaded on first use like the predictor
+cheap_recogniser = None
+
+def get_cheap_recogniser():
+    """
+    Returns the process-wide lightweight recognition model used to locate DOB regions.
+    """
+    global cheap_recogniser
+    if cheap_recogniser is None:
+        start = time.perf_counter()
+        from doctr.models import recognition_predictor
+        cheap_recogniser = recognition_predictor(ROI_CHEAP_RECO_ARCH, pretrained=True)
+        print(f"ROI recognition model {ROI_CHEAP_RECO_ARCH} loaded in {time.perf_counter() - start:.2f}s")
+    return cheap_recogniser
+
+# EXIF tag id for Orientation, resolved once per process instead of per image
+ORIENTATION_TAG = next(tag for tag, name in ExifTags.TAGS.items() if name == 'Orientation')
+
+# Longest image edge fed to the predictor; phone photos are downscaled to this.
+# Set OCR_MAX_IMAGE_EDGE=0 to keep full resolution.
+MAX_IMAGE_EDGE = int(os.getenv("OCR_MAX_IMAGE_EDGE", 2048))
+
+# Smallest long edge the JPEG decoder may scale down to. A little below
+# MAX_IMAGE_EDGE so a 4032px phone photo can be decoded at half size (2016px)
+# instead of in full.
+DRAFT_MIN_EDGE = int(os.getenv("OCR_DRAFT_MIN_EDGE", MAX_IMAGE_EDGE * 15 // 16))
+
 # Function to correct image orientation using Pillow
 def correct_image_orientation(image_path):
     try:
         image = Image.open(image_path)
-        for orientation in ExifTags.TAGS.keys():
-            if ExifTags.TAGS[orientation] == 'Orientation':
-                break
 
-        exif = image._getexif()
-        if exif is not None:
-            orientation_value = exif.get(orientation)
+        # Let the JPEG decoder scale down by a power of two while decoding.
+        # draft() only picks a scale that keeps both dimensions at or above
+        # the requested box, so the box follows the image's aspect ratio and
+        # only the long edge has to stay at least DRAFT_MIN_EDGE
+        if MAX_IMAGE_EDGE and image.format == 'JPEG':
+            scale = DRAFT_MIN_EDGE / max(image.size)
+            if scale < 1:
+                image.draft('RGB', (max(1, int(image.width * scale)), max(1, int(image.height * scale))))
+
+        exif = image.getexif()
+        if exif:
+            orientation_value = exif.get(ORIENTATION_TAG)
 
             if orientation_value == 3:
                 image = image.rotate(180, expand=True)
@@ -46,241 +135,865 @@ def correct_image_orientation(image_path):
         return None
 
 
-def extract_text_from_image(corrected_image, file_path, doc_id):
-    if corrected_image:
-        # Ensure file_path is a Path object
-        file_path = Path(file_path)
+def preprocess_image(image, max_edge=MAX_IMAGE_EDGE):
+    """
+    Converts an orientation-corrected image to RGB once and downscales it so
+    its longest edge is at most max_edge.
+    """
+    if image.mode != "RGB":
+        image = image.convert("RGB")
 
-        # Save the corrected image to a temporary file
-        temp_file_path = file_path.with_name("corrected_" + file_path.name)
-        corrected_image.save(temp_file_path)
+    if max_edge and max(image.size) > max_edge:
+        # thumbnail uses Image.reduce for the bulk of the shrink, then resamples
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
 
-        # Use the doctr library primarily
-        # Create an OCR predictor
-        predictor = ocr_predictor(pretrained=True)
+    return image
+
+
+def prepare_image(file_path, doc_id):
+    """
+    Runs orientation correction and preprocessing for one image, reporting the
+    latency and the process peak RSS.
+    """
+    start = time.perf_counter()
+    with metrics.timed("ocr", "decode_orientation", doc_id=doc_id):
+        image = correct_image_orientation(file_path)
+    if image is None:
+        return None
+
+    with metrics.timed("ocr", "preprocess", doc_id=doc_id):
+        image = preprocess_image(image)
+
+    # ru_maxrss is reported in kilobytes on Linux
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"Preprocessed doc_id {doc_id} to {image.size[0]}x{image.size[1]} "
+          f"in {time.perf_counter() - start:.2f}s (peak RSS {peak_rss_mb:.0f} MB)")
+    return image
+
+
+def load_image_pages(corrected_image):
+    """
+    Converts a corrected PIL image into a list of in-memory doctr pages,
+    avoiding a re-encode to disk and a second decode.
+    """
+    if corrected_image.mode != "RGB":
+        corrected_image = corrected_image.convert("RGB")
+    import numpy as np
+    return [np.asarray(corrected_image)]
+
+
+def pages_to_text(pages):
+    """
+    Joins the text of doctr result pages into a single string, one line per row.
+    """
+    all_text = []  # Initialize list to collect extracted text
+
+    # Iterate through the pages and collect text from blocks
+    for page in pages:
+        for block in page.blocks:
+            # Collect text from lines within each block
+            for line in block.lines:
+                # Join the text from each word in the line and append it to the list
+                all_text.append(" ".join([word.value for word in line.words]))
+
+    # Join all collected lines into a single string
+    return "\n".join(all_text)
+
+
+def update_response_data(doc_id, extracted_text, engine):
+    """
+    Stores the extracted text for an ocr_logs row, with the engine that
+    produced it, and marks it as completed.
+    """
+    # Check if extracted_text is not empty before proceeding
+    if not extracted_text.strip():
+        print("Extracted text is empty. Skipping database operation.")
+        return  # Exit the function if no text was extracted
+
+    connection = None  # Initialize connection before the try block
+
+    try:
+        # Borrow a pooled connection for the update
+        connection = db.get_connection()
+        if db.update_response_data(connection, doc_id, extracted_text, engine):
+            print(f"Updated response_data for doc_id {doc_id} ({engine}).")
+            metrics.inc("ocr_pipeline_engine_total", engine=engine)
+        else:
+            print(f"No data found for doc_id {doc_id}.")
+
+    except Error as e:
+        print(f"Error: {e}")
+
+    finally:
+        # Return the connection to the pool
+        if connection:
+            connection.close()
 
-        # Load the corrected image
-        image = DocumentFile.from_images(str(temp_file_path))
 
-        # Perform OCR on the image
-        result = predictor(image)
+@profiling.profiled("ocr_image", "doc_id")
+def extract_text_from_image(corrected_image, file_path, doc_id):
+    if corrected_image:
+        # Use the doctr library primarily
+        # Reuse the warm OCR predictor
+        predictor = get_predictor()
 
-        # Variables to track the number of words detected
-        total_detected_words = 0
-        all_text = []  # Initialize list to collect extracted text
+        # Load the corrected image
+        image = load_image_pages(corrected_image)
 
-        # Iterate through the pages and collect text from blocks
-        for page in result.pages:
-            for block in page.blocks:
-                # Collect text from lines within each block
-                for line in block.lines:
-                    # Join the text from each word in the line and append it to the list
-                    line_text = " ".join([word.value for word in line.words])
-                    all_text.append(line_text)
+        # Recognise only the DOB-relevant lines when ROI mode finds them
+        if ROI_MODE:
+            extracted_text = roi_text_from_pages(image, doc_id)
+            if accept_roi_text(extracted_text, doc_id):
+                print(extracted_text)
+                update_response_data(doc_id, extracted_text, "doctr-roi")
+                return extracted_text, "doctr-roi"
 
-                    # Increment the detected word count
-                    total_detected_words += len(line.words)
+        # Perform OCR on the image, timing inference only
+        start = time.perf_counter()
+        with metrics.timed("ocr", "inference", doc_id=doc_id):
+            result = predictor(image)
+        print(f"OCR inference for doc_id {doc_id} took {time.perf_counter() - start:.2f}s")
 
-        # Join all collected lines into a single string
-        extracted_text = "\n".join(all_text)
+        extracted_text = pages_to_text(result.pages)
 
         # Print the entire extracted text
         print(extracted_text)
 
-        # Optionally, remove the temporary file after processing
-        os.remove(temp_file_path)
+        update_response_data(doc_id, extracted_text, "doctr")
+        return extracted_text, "doctr"
+
+    else:
+        print("Error: Could not correct the image orientation.")
+        return None, None
+
+
+def detection_boxes(output):
+    """
+    Returns the (xmin, ymin, xmax, ymax) relative word boxes from one page of
+    detection output. Recent doctr releases return {class_name: boxes} per
+    page, older ones the box array itself.
+    """
+    if isinstance(output, dict):
+        output = output.get("words", next(iter(output.values())))
+    return output[:, :4]
+
+
+def crop_boxes(page, boxes):
+    """
+    Cuts the word crops for relative boxes out of a page array.
+    """
+    height, width = page.shape[:2]
+    crops = []
+    for xmin, ymin, xmax, ymax in boxes:
+        top, left = int(ymin * height), int(xmin * width)
+        bottom = max(top + 1, int(round(ymax * height)))
+        right = max(left + 1, int(round(xmax * width)))
+        crops.append(page[top:bottom, left:right])
+    return crops
+
+
+def group_lines(boxes):
+    """
+    Groups word boxes into text lines, top to bottom. Returns lists of box
+    indices, each ordered left to right.
+    """
+    order = sorted(range(len(boxes)), key=lambda i: boxes[i][1] + boxes[i][3])
+    lines = []
+    for index in order:
+        centre = (boxes[index][1] + boxes[index][3]) / 2
+        if lines:
+            first = boxes[lines[-1][0]]
+            # Same line when the centre falls within the line's first word
+            if first[1] <= centre <= first[3]:
+                lines[-1].append(index)
+                continue
+        lines.append([index])
+    return [sorted(line, key=lambda i: boxes[i][0]) for line in lines]
+
+
+def roi_text_from_pages(pages, doc_id):
+    """
+    Runs text detection once, reads every word with the cheap recogniser to
+    find lines with a DOB label or a date, and runs full recognition on those
+    lines only. Returns their text, or None when no page has a candidate.
+    """
+    predictor = get_predictor()
+    cheap = get_cheap_recogniser()
+
+    with metrics.timed("ocr", "roi_detection", doc_id=doc_id):
+        outputs = predictor.det_predictor(pages)
+
+    text_lines = []
+    for page, output in zip(pages, outputs):
+        boxes = detection_boxes(output)
+        if not len(boxes):
+            continue
+        crops = crop_boxes(page, boxes)
+        lines = group_lines(boxes)
+
+        with metrics.timed("ocr", "roi_cheap_recognition", doc_id=doc_id, words=len(crops)):
+            words = [value for value, _ in cheap(crops)]
+
+        selected = set()
+        for number, line in enumerate(lines):
+            line_text = " ".join(words[i] for i in line)
+            if dobparse.DOB_LABEL_PATTERN.search(line_text):
+                selected.update(range(number, min(len(lines), number + ROI_LINES_AFTER_LABEL + 1)))
+            elif dobparse.DATE_TOKEN_PATTERN.search(line_text):
+                selected.add(number)
+        if not selected:
+            continue
+
+        chosen = [lines[number] for number in sorted(selected)]
+        chosen_crops = [crops[i] for line in chosen for i in line]
+        with metrics.timed("ocr", "roi_recognition", doc_id=doc_id, words=len(chosen_crops)):
+            values = [value for value, _ in predictor.reco_predictor(chosen_crops)]
+
+        offset = 0
+        for line in chosen:
+            text_lines.append(" ".join(values[offset:offset + len(line)]))
+            offset += len(line)
+
+        print(f"ROI OCR for doc_id {doc_id}: recognised {len(chosen_crops)} of {len(crops)} words")
+
+    return "\n".join(text_lines) if text_lines else None
+
+
+def accept_roi_text(extracted_text, doc_id):
+    """
+    Keeps ROI text only if a DOB can be read from it with at least
+    ROI_MIN_DOB_CONFIDENCE; otherwise the caller falls back to whole-page recognition.
+    """
+    dob, dob_confidence = dobparse.extract_dob(extracted_text)
+    accepted = bool(dob) and dob_confidence >= ROI_MIN_DOB_CONFIDENCE
+    outcome = "hit" if accepted else "fallback"
+    metrics.inc("ocr_pipeline_roi_total", outcome=outcome)
+    if not dob:
+        print(f"ROI OCR found no DOB for doc_id {doc_id}, recognising whole pages")
+    elif not accepted:
+        print(f"ROI OCR DOB for doc_id {doc_id} has confidence {dob_confidence:.2f}, recognising whole pages")
+    return accepted
+
+
+def try_fast_engine(corrected_image, doc_id):
+    """
+    In adaptive mode, OCRs a corrected image with Tesseract and keeps the
+    result only if the mean word confidence is high enough and it contains a
+    confident DOB. Returns the stored text, or None when doctr should run.
+    """
+    global fast_engine_hits, fast_engine_escalations
+    if OCR_ENGINE != "adaptive" or not corrected_image:
+        return None
 
-        # Check if extracted_text is not empty before proceeding
-        if not extracted_text.strip():
-            print("Extracted text is empty. Skipping database operation.")
-            return  # Exit the function if no text was extracted
+    try:
+        import pytesseract
+        with metrics.timed("ocr", "fast_pass", doc_id=doc_id):
+            data = pytesseract.image_to_data(corrected_image, output_type=pytesseract.Output.DICT)
+    except Exception as e:
+        print(f"Error running Tesseract for doc_id {doc_id}: {e}")
+        fast_engine_escalations += 1
+        return None
 
-        connection = None  # Initialize connection before the try block
-        cursor = None      # Initialize cursor to ensure it's defined if used in finally block
+    # Rebuild the text line by line; conf is -1 for layout-only entries
+    lines = {}
+    confidences = []
+    for index, word in enumerate(data["text"]):
+        confidence = float(data["conf"][index])
+        if not word.strip() or confidence < 0:
+            continue
+        line_key = (data["block_num"][index], data["par_num"][index], data["line_num"][index])
+        lines.setdefault(line_key, []).append(word)
+        confidences.append(confidence)
+
+    extracted_text = "\n".join(" ".join(words) for words in lines.values())
+    mean_confidence = sum(confidences) / len(confidences) if confidences else 0.0
+    dob, dob_confidence = dobparse.extract_dob(extracted_text)
+
+    if mean_confidence < FAST_OCR_MIN_CONFIDENCE or not dob or dob_confidence < FAST_OCR_MIN_DOB_CONFIDENCE:
+        fast_engine_escalations += 1
+        print(f"Escalating doc_id {doc_id} to doctr (Tesseract confidence {mean_confidence:.0f}, "
+              f"DOB {'found' if dob else 'not found'})")
+        return None
 
+    fast_engine_hits += 1
+    print(extracted_text)
+    update_response_data(doc_id, extracted_text, "tesseract")
+    return extracted_text
+
+
+def print_fast_engine_stats():
+    """
+    Reports how many documents the fast OCR pass handled without doctr.
+    """
+    total = fast_engine_hits + fast_engine_escalations
+    if total:
+        print(f"Fast OCR engine: {fast_engine_hits}/{total} documents ({fast_engine_hits / total:.0%}) skipped doctr")
+
+
+def batch_doc_ids(batch):
+    """
+    Profile label for a batch of (doc_id, pages, cache_key) tuples.
+    """
+    if len(batch) == 1:
+        return batch[0][0]
+    return f"{batch[0][0]}-{batch[-1][0]}"
+
+
+@profiling.profiled("ocr_image_batch", "batch", id_from=batch_doc_ids)
+def extract_text_from_image_batch(batch, on_result=None):
+    """
+    Runs one predictor call over the pages of several documents and maps the
+    result pages back to their ocr_logs ids.
+
+    batch is a list of (doc_id, pages, cache_key) tuples, where pages come
+    from load_image_pages. If the batched call fails, each document is run on
+    its own so one bad image only fails its own row. on_result(doc_id, text)
+    is called for every document, with None for failures.
+    """
+    if not batch:
+        return
+
+    predictor = get_predictor()
+
+    # Flatten every document's pages into a single predictor input
+    all_pages = [page for _, pages, _ in batch for page in pages]
+
+    start = time.perf_counter()
+    try:
+        with metrics.timed("ocr", "inference_batch", documents=len(batch), pages=len(all_pages)):
+            result = predictor(all_pages)
+    except Exception as e:
+        if len(batch) == 1:
+            doc_id = batch[0][0]
+            print(f"Error running OCR for doc_id {doc_id}: {e}")
+            metrics.document_done("ocr", "failed", doc_id=doc_id)
+            if on_result:
+                on_result(doc_id, None)
+            return
+        print(f"Error running OCR for a batch of {len(batch)} documents, retrying one by one: {e}")
+        for item in batch:
+            extract_text_from_image_batch([item], on_result)
+        return
+    elapsed = time.perf_counter() - start
+    print(f"OCR inference for {len(batch)} documents ({len(all_pages)} pages) took {elapsed:.2f}s")
+
+    # Result pages come back in input order, so slice them per document
+    offset = 0
+    for doc_id, pages, key in batch:
+        doc_pages = result.pages[offset:offset + len(pages)]
+        offset += len(pages)
+
+        extracted_text = pages_to_text(doc_pages)
+        print(extracted_text)
+        update_response_data(doc_id, extracted_text, "doctr")
+        ocrcache.store_cached_text(key, extracted_text, "doctr")
+        metrics.document_done("ocr", "ok" if extracted_text.strip() else "empty", doc_id=doc_id)
+        if on_result:
+            on_result(doc_id, extracted_text)
+
+
+def put_unless_stopped(raster_queue, item, stop):
+    """
+    Puts item on the bounded raster_queue, giving up if stop is set while the
+    queue is full. Returns False if it gave up.
+    """
+    while not stop.is_set():
         try:
-            # Connect to the MySQL database
-            connection = mysql.connector.connect(
-                host=os.getenv("DB_HOST"),           # e.g., 'localhost' or the server's IP
-                user=os.getenv("DB_USERNAME"),       # e.g., 'root'
-                password=os.getenv("DB_PASSWORD"),   # your MySQL password
-                database=os.getenv("DB_DATABASE")    # the database name
-            )
-
-            if connection.is_connected():
-                print("Connected to the database")
-
-                # Create a cursor object
-                cursor = connection.cursor()
-
-                # Define the query to read data from the ocr_logs table using the given doc_id
-                select_query = """
-                SELECT * FROM `ocr_logs` WHERE `id` = %s ORDER BY `id` ASC
-                """
-                cursor.execute(select_query, (doc_id,))
-
-                # Fetch the row matching the doc_id
-                row = cursor.fetchone()
-
-                # If the data is found, update the response_data with the extracted text
-                if row:
-                    update_query = """
-                    UPDATE `ocr_logs` 
-                    SET `response_data` = %s ,`read_status`='completed'
-                    WHERE `id` = %s ORDER BY `id` ASC
-                    """
-                    cursor.execute(update_query, (extracted_text, doc_id))
-                    connection.commit()
-                    print(f"Updated response_data for doc_id {doc_id}.")
-                else:
-                    print(f"No data found for doc_id {doc_id}.")
+            raster_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def rasterise_pdf_pages(pdf_file, page_numbers, raster_queue, stop):
+    """
+    Renders the given PDF pages at PDF_OCR_DPI and puts (page_number, pages)
+    tuples on raster_queue, followed by None, or by the exception if a page
+    could not be rendered. Runs on its own thread; the bounded queue keeps only
+    a few rasters in memory at once. Setting stop makes it close the PDF and exit.
+    """
+    import pdfplumber
 
-        except Error as e:
-            print(f"Error: {e}")
+    try:
+        with pdfplumber.open(pdf_file) as pdf:
+            for page_number in page_numbers:
+                page = pdf.pages[page_number]
+                with metrics.timed("ocr", "pdf_rasterise", page=page_number):
+                    image = page.to_image(resolution=PDF_OCR_DPI).original
+                    pages = load_image_pages(preprocess_image(image))
+                # Drop the page's parsed objects before moving on
+                page.close()
+                if not put_unless_stopped(raster_queue, (page_number, pages), stop):
+                    return
+    except Exception as e:
+        put_unless_stopped(raster_queue, e, stop)
+        return
+    put_unless_stopped(raster_queue, None, stop)
+
+
+def ocr_scanned_pdf_pages(pdf_file, page_numbers, doc_id, roi=False):
+    """
+    OCRs image-only PDF pages, rasterising the next page while the predictor
+    works on the current one. With roi=True only DOB-relevant lines are
+    recognised. Returns {page_number: text}; raises if any page could not be
+    rasterised or recognised, so a partial result is never written back.
+    """
+    predictor = get_predictor()
+    raster_queue = queue.Queue(maxsize=PDF_RASTER_QUEUE_SIZE)
+    stop = threading.Event()
+    rasteriser = threading.Thread(
+        target=rasterise_pdf_pages, args=(pdf_file, page_numbers, raster_queue, stop), daemon=True
+    )
+    rasteriser.start()
+
+    texts = {}
+    start = time.perf_counter()
+    try:
+        while True:
+            item = raster_queue.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            page_number, pages = item
+            if roi:
+                texts[page_number] = roi_text_from_pages(pages, doc_id) or ""
+                continue
+            with metrics.timed("ocr", "pdf_inference", doc_id=doc_id, page=page_number):
+                texts[page_number] = pages_to_text(predictor(pages).pages)
+    finally:
+        # If we stopped early the rasteriser may be blocked on the full queue;
+        # tell it to stop so it closes the PDF instead of leaking the thread
+        stop.set()
+        rasteriser.join()
 
-        finally:
-            # Close the cursor if it exists
-            if cursor:
-                cursor.close()
-            # Close the database connection
-            if connection and connection.is_connected():
-                connection.close()
-                print("Connection closed")
+    print(f"OCR of {len(texts)} scanned PDF pages for doc_id {doc_id} took {time.perf_counter() - start:.2f}s")
+    return texts
 
-    else:
-        print("Error: Could not correct the image orientation.")
 
+@profiling.profiled("ocr_pdf", "doc_id")
 def extract_text_from_pdf(pdf_file,doc_id):
+    import pdfplumber
+
     try:
         # Open the PDF file using pdfplumber
         with pdfplumber.open(pdf_file) as pdf:
-            extracted_text = ""
-            
-            # Iterate through all the pages
-            for page in pdf.pages:
-                # Extract text from the page
-                extracted_text += page.extract_text() + "\n"
-            
-            # Check if extracted_text is not empty before proceeding
-            if not extracted_text.strip():
-                print("Extracted text is empty. Skipping database operation.")
-                return  # Exit the function if no text was extracted
-            connection = None  # Initialize connection before the try block
-            cursor = None      # Initialize cursor to ensure it's defined if used in finally block
-
-            try:
-                # Connect to the MySQL database
-                connection = mysql.connector.connect(
-                    host=os.getenv("DB_HOST"),           # e.g., 'localhost' or the server's IP
-                    user=os.getenv("DB_USERNAME"),       # e.g., 'root'
-                    password=os.getenv("DB_PASSWORD"),   # your MySQL password
-                    database=os.getenv("DB_DATABASE")    # the database name
-                )
-
-                if connection.is_connected():
-                    print("Connected to the database")
-
-                    # Create a cursor object
-                    cursor = connection.cursor()
-
-                    # Define the query to read data from the ocr_logs table using the given doc_id
-                    select_query = """
-                    SELECT * FROM `ocr_logs` WHERE `id` = %s ORDER BY `id` ASC
-                    """
-                    cursor.execute(select_query, (doc_id))
-
-                    # Fetch the row matching the doc_id
-                    row = cursor.fetchone()
-
-                    # If the data is found, update the response_data with the extracted text
-                    if row:
-                        update_query = """
-                        UPDATE `ocr_logs` 
-                        SET `response_data` = %s ,`read_status`='completed'
-                        WHERE `id` = %s ORDER BY `id` ASC
-                        """
-                        cursor.execute(update_query, (extracted_text, doc_id))
-                        connection.commit()
-                        print(f"Updated response_data for doc_id {doc_id}.")
-                    else:
-                        print(f"No data found for doc_id {doc_id}.")
-
-            except Error as e:
-                print(f"Error: {e}")
-
-            finally:
-                # Close the cursor if it exists
-                if cursor:
-                    cursor.close()
-                # Close the database connection
-                if connection and connection.is_connected():
-                    connection.close()
-                    print("Connection closed")
+            page_texts = {}
+            scanned_pages = []
+
+            # Use the text layer where a page has one, and remember the image-only pages
+            for page_number, page in enumerate(pdf.pages):
+                with metrics.timed("ocr", "pdf_text", doc_id=doc_id, page=page_number):
+                    text = page.extract_text() or ""
+                if text.strip():
+                    page_texts[page_number] = text
+                else:
+                    scanned_pages.append(page_number)
+                page.close()
+
+        # Send image-only pages through the OCR predictor, trying only the
+        # DOB-relevant lines first in ROI mode
+        engine = "pdfplumber"
+        if scanned_pages and ROI_MODE:
+            roi_texts = ocr_scanned_pdf_pages(pdf_file, scanned_pages, doc_id, roi=True)
+            if accept_roi_text("\n".join(roi_texts.values()), doc_id):
+                page_texts.update(roi_texts)
+                engine = "pdfplumber+doctr-roi"
+        if scanned_pages and engine == "pdfplumber":
+            page_texts.update(ocr_scanned_pdf_pages(pdf_file, scanned_pages, doc_id))
+            engine = "pdfplumber+doctr"
+
+        extracted_text = "\n".join(page_texts[number] for number in sorted(page_texts))
+
+        update_response_data(doc_id, extracted_text, engine)
+        return extracted_text, engine
     except Exception as e:
         print(f"Error reading PDF file: {e}")
-        return None
+        return None, None
 
 
-def connect_and_read_oc():
-    connection = None  # Initialize connection before the try block
-    cursor = None      # Initialize cursor to ensure it's defined if used in finally block
+def package_version(name):
+    """
+    Returns an installed package's version without importing it.
+    """
     try:
-        # Connect to the MySQL database
-        connection = mysql.connector.connect(
-            host=os.getenv("DB_HOST"),           # e.g., 'localhost' or the server's IP
-            user=os.getenv("DB_USERNAME"),       # e.g., 'root'
-            password=os.getenv("DB_PASSWORD"),   # your MySQL password
-            database=os.getenv("DB_DATABASE")    # the database name
+        return metadata.version(name)
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+
+def document_cache_key(file_path, file_type):
+    """
+    Returns the OCR cache key for a document, tied to the engine that would
+    process it and the settings that affect its output.
+    """
+    doctr_version = package_version("python-doctr")
+    if ROI_MODE:
+        doctr_version += f"-roi-{ROI_CHEAP_RECO_ARCH}-{ROI_LINES_AFTER_LABEL}-dob{ROI_MIN_DOB_CONFIDENCE}"
+
+    if file_type == 'application/pdf':
+        return ocrcache.cache_key(
+            file_path, "pdfplumber+doctr",
+            f"{package_version('pdfplumber')}-{doctr_version}-dpi{PDF_OCR_DPI}-edge{MAX_IMAGE_EDGE}",
         )
 
-        if connection.is_connected():
-            print("Connected to the database")
+    if OCR_ENGINE == "adaptive":
+        return ocrcache.cache_key(
+            file_path, "tesseract+doctr",
+            f"{package_version('pytesseract')}-{doctr_version}-edge{MAX_IMAGE_EDGE}"
+            f"-conf{FAST_OCR_MIN_CONFIDENCE}-dob{FAST_OCR_MIN_DOB_CONFIDENCE}",
+        )
 
-            # Create a cursor object
-            cursor = connection.cursor()
+    return ocrcache.cache_key(file_path, "doctr", f"{doctr_version}-edge{MAX_IMAGE_EDGE}")
 
-            # Define the query to read data from the ocr_logs table
-            query = """
-            SELECT * FROM `ocr_logs` WHERE `read_status`='pending' ORDER BY `doc_id` ASC
-            """
 
-            # Execute the query
-            cursor.execute(query)
+def apply_cached_result(doc_id, key):
+    """
+    Writes a cached OCR result for a document, recording the engine that
+    originally produced it. Returns the cached text on a cache hit, otherwise None.
+    """
+    cached = ocrcache.get_cached_text(key)
+    if cached is None:
+        return None
 
-            # Fetch all rows from the executed query
-            rows = cursor.fetchall()
+    cached_text, engine = cached
+    print(f"OCR cache hit for doc_id {doc_id}.")
+    # Entries cached before engines were recorded only say they came from the cache
+    update_response_data(doc_id, cached_text, engine or "cache")
+    metrics.document_done("ocr", "cached", doc_id=doc_id)
+    return cached_text
+
+
+def process_row(row):
+    """
+    Runs OCR for a single ocr_logs row, reusing a cached result for identical
+    files. Returns the extracted text, or None if nothing was extracted.
+    """
+    doc_id = row["id"]
+    file_path = row["file_disk_path"]
+    file_type = row["file_type"]
+
+    # The row may have waited in a queue; skip it if its lease went to another worker
+    if not db.renew_lease(row):
+        print(f"Lease on doc_id {doc_id} was lost, skipping it.")
+        return None
 
-            # Iterate through the fetched rows
-            for row in rows:
-                # Use proper string formatting to print the file path
-               # print(f"File path: {row[6]}")
+    key = document_cache_key(file_path, file_type)
+    cached_text = apply_cached_result(doc_id, key)
+    if cached_text is not None:
+        return cached_text
 
-                # Image URL to be downloaded and processed
-                file_path = row[7]
-                file_type  = row[8]
+    if file_type == 'application/pdf':
+        extracted_text, engine = extract_text_from_pdf(file_path, doc_id)
+    else:
+        corrected_image = prepare_image(file_path, doc_id)
+        extracted_text, engine = try_fast_engine(corrected_image, doc_id), "tesseract"
+        if extracted_text is None:
+            extracted_text, engine = extract_text_from_image(corrected_image, file_path, doc_id)
+
+    ocrcache.store_cached_text(key, extracted_text, engine)
+    metrics.document_done("ocr", "ok" if extracted_text and extracted_text.strip() else "empty", doc_id=doc_id)
+    return extracted_text
+
+
+def init_ocr_worker(torch_threads):
+    """
+    Process pool initializer: caps torch intra-op threads so workers do not
+    oversubscribe the CPU, then warms this worker's own predictor.
+    """
+    import torch
+    torch.set_num_threads(torch_threads)
+
+    # Each worker only writes back one document at a time, so keep its own pool small
+    os.environ["DB_POOL_SIZE"] = os.getenv("OCR_WORKER_DB_POOL_SIZE", "1")
+
+    get_predictor()
+
+
+def ocr_counters():
+    """
+    Returns this process's cache and fast-engine counters as a tuple.
+    """
+    return ocrcache.hits, ocrcache.misses, fast_engine_hits, fast_engine_escalations
+
+
+def add_ocr_counters(deltas):
+    """
+    Adds counter deltas reported by a pool worker to this process's counters,
+    so the parent's cache and fast-engine stats cover the whole run.
+    """
+    global fast_engine_hits, fast_engine_escalations
+    cache_hits, cache_misses, fast_hits, fast_escalations = deltas
+    ocrcache.hits += cache_hits
+    ocrcache.misses += cache_misses
+    fast_engine_hits += fast_hits
+    fast_engine_escalations += fast_escalations
+
+
+def ocr_row_worker(row):
+    """
+    Processes a single ocr_logs row inside a pool worker. Errors are caught and
+    reported back so one bad document cannot take down the pool.
+    Returns (doc_id, extracted_text, error, counter deltas for add_ocr_counters).
+    """
+    doc_id = row["id"]
+    before = ocr_counters()
+    try:
+        extracted_text, error = process_row(row), None
+    except Exception as e:
+        extracted_text, error = None, str(e)
+    deltas = tuple(after - start for after, start in zip(ocr_counters(), before))
+    return doc_id, extracted_text, error, deltas
+
+
+# The OCR process pool is kept for the life of the process, so pool workers
+# load their predictor once rather than on every poll pass or pipeline run
+ocr_pool = None
+ocr_pool_settings = None
+
+
+def get_ocr_pool(workers, torch_threads, start_method):
+    """
+    Returns the process's OCR pool, starting it on first use or when the
+    worker settings change.
+    """
+    global ocr_pool, ocr_pool_settings
+    settings = (workers, torch_threads, start_method)
+    if ocr_pool is None or ocr_pool_settings != settings:
+        discard_ocr_pool()
+        print(f"Starting {workers} OCR workers ({torch_threads} torch threads each)")
+        ocr_pool = ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context(start_method),
+            initializer=init_ocr_worker, initargs=(torch_threads,),
+        )
+        ocr_pool_settings = settings
+    return ocr_pool
+
+
+def discard_ocr_pool():
+    """
+    Shuts the OCR pool down so the next get_ocr_pool starts a fresh one.
+    """
+    global ocr_pool, ocr_pool_settings
+    if ocr_pool is not None:
+        ocr_pool.shutdown(wait=False, cancel_futures=True)
+    ocr_pool = None
+    ocr_pool_settings = None
+
+
+def run_pool_window(rows, workers, max_in_flight, torch_threads, start_method, on_result=None):
+    """
+    Runs rows through the OCR process pool, submitting lazily so at most
+    max_in_flight rows are queued at once. Returns the rows that were in flight
+    if a worker process died and broke the pool (which is then discarded),
+    otherwise an empty list once rows is exhausted.
+    """
+    pool = get_ocr_pool(workers, torch_threads, start_method)
+    in_flight = {}
+    while True:
+        for row in itertools.islice(rows, max_in_flight - len(in_flight)):
+            try:
+                in_flight[pool.submit(ocr_row_worker, row)] = row
+            except BrokenProcessPool:
+                discard_ocr_pool()
+                return [row, *in_flight.values()]
+        if not in_flight:
+            return []
+
+        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                doc_id, extracted_text, error, deltas = future.result()
+            except BrokenProcessPool:
+                # Every unfinished future fails with the pool, so hand them all back
+                discard_ocr_pool()
+                return list(in_flight.values())
+            del in_flight[future]
+            add_ocr_counters(deltas)
+            if error:
+                print(f"Error processing doc_id {doc_id}: {error}")
+            if on_result:
+                on_result(doc_id, extracted_text)
+
+
+def process_rows_parallel(rows, workers, on_result=None, start_method=None):
+    """
+    Fans ocr_logs rows out over a process pool with one warm predictor per worker.
+
+    The pool outlives the call, so later runs reuse its warm workers. If a
+    worker dies (segfault, OOM kill) the pool is rebuilt. The rows that were
+    in flight are re-run one at a time so only the document that kills a
+    worker is skipped, and the run carries on with the remaining rows.
+
+    Workers are forked by default so they inherit the loaded modules; callers
+    running other threads should pass start_method="spawn" instead, since a
+    forked child can inherit locks held by those threads.
+    """
+    if start_method is None:
+        start_method = os.getenv("OCR_POOL_START_METHOD", "fork")
+    torch_threads = int(os.getenv("OCR_TORCH_THREADS", max(1, (os.cpu_count() or 1) // workers)))
+
+    rows = iter(rows)
+    while True:
+        unfinished = run_pool_window(rows, workers, workers * 2, torch_threads, start_method, on_result)
+        if not unfinished:
+            return
+
+        print(f"Error: an OCR worker died, re-running {len(unfinished)} in-flight documents one at a time")
+        suspects = iter(unfinished)
+        while True:
+            crashed = run_pool_window(suspects, workers, 1, torch_threads, start_method, on_result)
+            if not crashed:
+                break
+            doc_id = crashed[0]["id"]
+            print(f"Error: doc_id {doc_id} crashed an OCR worker, skipping it")
+            metrics.document_done("ocr", "failed", doc_id=doc_id)
+            if on_result:
+                on_result(doc_id, None)
+
+
+def process_rows_batched(rows, on_result=None):
+    """
+    OCRs rows in this process, sending images through the predictor in
+    batches of OCR_BATCH_SIZE (at most OCR_BATCH_MAX_PAGES pages) to pay the
+    per-call overhead once per batch. PDFs, ROI mode and a batch size of 1
+    process one document at a time.
+    """
+    batch_size = int(os.getenv("OCR_BATCH_SIZE", 8))
+    max_pages = int(os.getenv("OCR_BATCH_MAX_PAGES", 32))
+    batch = []
+    batch_pages = 0
+
+    def report(doc_id, extracted_text):
+        if on_result:
+            on_result(doc_id, extracted_text)
+
+    for row in rows:
+        doc_id = row["id"]
+        file_path = row["file_disk_path"]
+        file_type = row["file_type"]
+
+        # ROI mode picks crops per document from its own detection results
+        if file_type == 'application/pdf' or batch_size <= 1 or ROI_MODE:
+            try:
+                extracted_text = process_row(row)
+            except Exception as e:
+                # One bad document must not end the run or a long-lived worker
+                print(f"Error processing doc_id {doc_id}: {e}")
+                metrics.document_done("ocr", "failed", doc_id=doc_id)
+                extracted_text = None
+            report(doc_id, extracted_text)
+            continue
 
-                if file_type == 'application/pdf':
-                    extracted_text = extract_text_from_pdf(file_path, row[0])
-                else:
-                    # Correct the image orientation
-                    corrected_image = correct_image_orientation(file_path)
+        try:
+            if not db.renew_lease(row):
+                print(f"Lease on doc_id {doc_id} was lost, skipping it.")
+                continue
+
+            # Skip inference entirely for files OCR'd before
+            key = document_cache_key(file_path, file_type)
+            cached_text = apply_cached_result(doc_id, key)
+            if cached_text is not None:
+                report(doc_id, cached_text)
+                continue
+
+            # Correct the image orientation
+            corrected_image = prepare_image(file_path, doc_id)
+
+            if not corrected_image:
+                print("Error: Could not correct the image orientation.")
+                report(doc_id, None)
+                continue
+
+            # Documents the fast engine can read never join a doctr batch
+            extracted_text = try_fast_engine(corrected_image, doc_id)
+            if extracted_text is not None:
+                ocrcache.store_cached_text(key, extracted_text, "tesseract")
+                metrics.document_done("ocr", "ok", doc_id=doc_id)
+                report(doc_id, extracted_text)
+                continue
+
+            pages = load_image_pages(corrected_image)
+        except Exception as e:
+            print(f"Error processing doc_id {doc_id}: {e}")
+            metrics.document_done("ocr", "failed", doc_id=doc_id)
+            report(doc_id, None)
+            continue
+
+        # Flush first if this document would push the batch past the page cap
+        if batch and batch_pages + len(pages) > max_pages:
+            extract_text_from_image_batch(batch, on_result)
+            batch, batch_pages = [], 0
+
+        batch.append((doc_id, pages, key))
+        batch_pages += len(pages)
+
+        if len(batch) >= batch_size:
+            extract_text_from_image_batch(batch, on_result)
+            batch, batch_pages = [], 0
+
+    # Process whatever is left in the final partial batch
+    if batch:
+        extract_text_from_image_batch(batch, on_result)
+
+
+def process_rows(rows, on_result=None, start_method=None):
+    """
+    OCRs ocr_logs rows with the configured executor: a process pool when
+    OCR_WORKERS > 1, otherwise batched predictor calls in this process.
+    on_result(doc_id, extracted_text) is called as each document finishes,
+    with None when it failed.
+    """
+    workers = int(os.getenv("OCR_WORKERS", 1))
+    if workers > 1:
+        process_rows_parallel(rows, workers, on_result, start_method)
+    else:
+        process_rows_batched(rows, on_result)
 
-                    # Extract text from the image
-                    extract_text_from_image(corrected_image, file_path, row[0])  # Pass the correct doc_id from row
 
-    except Error as e:
+# Columns the OCR stage needs from ocr_logs
+OCR_WORK_COLUMNS = ("id", "file_disk_path", "file_type")
+
+
+def connect_and_read_oc():
+    try:
+        # Claim pending rows batch by batch instead of loading them all up front
+        rows = db.fetch_work(OCR_WORK_COLUMNS, "`read_status` = 'pending'")
+        process_rows(rows)
+
+        stats = ocrcache.cache_stats()
+        print(f"OCR cache: {stats['hits']} hits, {stats['misses']} misses")
+        print_fast_engine_stats()
+
+    except Exception as e:
         print(f"Error: {e}")
 
-    finally:
-        # Close the cursor if it exists
-        if cursor:
-            cursor.close()
-        # Close the database connection
-        if connection and connection.is_connected():
-            connection.close()
-            print("Connection closed")
+def run_ocr_worker(poll_interval=None):
+    """
+    Runs a long-lived OCR worker that loads the predictor once and keeps
+    draining pending ocr_logs rows, sleeping between empty polls.
+    """
+    if poll_interval is None:
+        poll_interval = float(os.getenv("OCR_WORKER_POLL_INTERVAL", 10))
+
+    # Load the model up front so per-document latency reflects inference only
+    get_predictor()
 
-# Run the function
-print("Starting connect_and_read_oc...")
-connect_and_read_oc()
-print("connect_and_read_oc completed.")
\ No newline at end of file
+    print(f"OCR worker started, polling every {poll_interval}s")
+    while True:
+        try:
+            connect_and_read_oc()
+        except Exception as e:
+            # Keep polling; the rows of a failed pass are retried once their leases expire
+            print(f"Error in OCR worker pass: {e}")
+        time.sleep(poll_interval)
+
+# Run the function when executed as a script
+if __name__ == "__main__":
+    if os.getenv("OCR_WORKER_MODE") == "1":
+        run_ocr_worker()
+    else:
+        print("Starting connect_and_read_oc...")
+        connect_and_read_oc()
+        print("connect_and_read_oc completed.")
\ No newline at end of file
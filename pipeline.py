@@ -0,0 +1,271 @@
+import asyncio
+import os
+import queue
+import threading
+import time
+
+import db
+import metrics
+from dbread import connect_and_read
+import ocread
+import ocrai
+
+# Marks the end of a producer's output on a stage queue
+DONE = object()
+
+
+class StageStats:
+    """
+    Thread-safe processed/failed counters for one pipeline stage.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.processed = 0
+        self.failed = 0
+        self.lock = threading.Lock()
+
+    def record(self, ok):
+        with self.lock:
+            if ok:
+                self.processed += 1
+            else:
+                self.failed += 1
+
+
+def feed_ocr_queue(ocr_queue):
+    """
+    Ingests new documents, then claims pending OCR work and feeds it into the
+    OCR queue. put() blocks while the queue is full, which is the backpressure
+    that stops claiming more rows than the OCR stage can keep up with.
+    """
+    try:
+        connect_and_read()
+        for row in db.fetch_work(ocread.OCR_WORK_COLUMNS, "`read_status` = 'pending'"):
+            ocr_queue.put(row)
+    except Exception as e:
+        print(f"Error in ingest stage: {e}")
+    finally:
+        ocr_queue.put(DONE)
+
+
+def feed_dob_backlog(dob_queue):
+    """
+    Claims rows that finished OCR in earlier runs but still have no DOB, and
+    feeds them into the DOB queue alongside freshly OCR'd documents.
+    """
+    try:
+        for row in db.fetch_work(ocrai.OCRAI_WORK_COLUMNS, ocrai.OCRAI_WORK_FILTER):
+            dob_queue.put((row["id"], row["response_data"], row))
+    except Exception as e:
+        print(f"Error in DOB backlog stage: {e}")
+    finally:
+        dob_queue.put(DONE)
+
+
+def drain(stage_queue, producers=1):
+    """
+    Yields items from a stage queue until every producer has sent DONE.
+    """
+    finished = 0
+    while finished < producers:
+        item = stage_queue.get()
+        if item is DONE:
+            finished += 1
+            continue
+        yield item
+
+
+def run_ocr_stage(ocr_queue, dob_queue, stats):
+    """
+    OCRs rows from the OCR queue with the configured executor (OCR_WORKERS,
+    OCR_BATCH_SIZE) and hands each extracted text straight to the DOB stage.
+    """
+    def on_result(doc_id, extracted_text):
+        ok = bool(extracted_text and extracted_text.strip())
+        stats.record(ok)
+        if ok:
+            # Not claimed yet: the DOB stage claims it before calling the LLM
+            dob_queue.put((doc_id, extracted_text, None))
+
+    try:
+        # Load the model before the first document arrives; if this fails each
+        # row fails on its own, so the queue keeps draining
+        if int(os.getenv("OCR_WORKERS", 1)) <= 1:
+            try:
+                ocread.get_predictor()
+            except Exception as e:
+                print(f"Error loading OCR model: {e}")
+
+        # This process runs other threads, so pool workers are spawned rather than forked
+        rows = drain(ocr_queue)
+        try:
+            ocread.process_rows(rows, on_result, start_method="spawn")
+        except Exception as e:
+            print(f"Error in OCR stage: {e}")
+        # Keep draining so the ingest stage never blocks on a full queue
+        for _ in rows:
+            pass
+    finally:
+        dob_queue.put(DONE)
+
+
+def claim_dob_items(items, stats):
+    """
+    Claims freshly OCR'd documents and renews the leases of backlog rows,
+    yielding the ones this process still holds as rows for the DOB executors.
+    """
+    for file_id, text, claimed_row in items:
+        try:
+            # Freshly OCR'd rows are claimed here so another node cannot send
+            # them twice; backlog rows may have queued a while, so renew their lease
+            if claimed_row is None:
+                if not db.claim_row(file_id, ocrai.OCRAI_WORK_FILTER):
+                    continue
+            elif not db.renew_lease(claimed_row):
+                print(f"Lease on doc_id {file_id} was lost, skipping it.")
+                continue
+        except Exception as e:
+            print(f"Error claiming doc_id {file_id}: {e}")
+            stats.record(False)
+            continue
+        yield {"id": file_id, "response_data": text}
+
+
+def run_dob_stage_async(items, connection, stats):
+    """
+    Runs the DOB stage through the local parser and the concurrent LLM
+    executor, the same path OCRAI_ASYNC=1 takes outside the pipeline.
+    """
+    def on_result(file_id, dob):
+        stats.record(bool(dob))
+
+    # Rows are pulled while LLM answers are written back, so local answers get their own connection
+    local_connection = db.get_connection()
+    try:
+        pending = ocrai.resolve_locally(claim_dob_items(items, stats), local_connection, on_result)
+        asyncio.run(ocrai.extract_dobs_async(pending, connection, on_result))
+    finally:
+        local_connection.close()
+
+
+def run_dob_stage_sync(items, connection, stats):
+    """
+    Extracts DOBs one document at a time as they arrive.
+    """
+    handled = 0
+    for row in claim_dob_items(items, stats):
+        file_id = row["id"]
+        try:
+            dob = ocrai.extract_dob_from_text(row["response_data"], file_id)
+            db.update_dob(connection, file_id, dob if dob else '', ocrai.dob_status(dob))
+            stats.record(bool(dob))
+        except Exception as e:
+            print(f"Error extracting DOB for doc_id {file_id}: {e}")
+            stats.record(False)
+            continue
+
+        handled += 1
+        if handled % ocrai.COST_FLUSH_EVERY == 0:
+            ocrai.flush_costs(connection)
+
+
+def run_dob_stage(dob_queue, producers, stats):
+    """
+    Extracts DOBs from the DOB queue as soon as documents arrive, until every
+    producer has finished. OCRAI_ASYNC=1 runs the requests concurrently.
+    """
+    items = drain(dob_queue, producers)
+    connection = None
+    try:
+        connection = db.get_connection()
+        if os.getenv("OCRAI_ASYNC") == "1":
+            run_dob_stage_async(items, connection, stats)
+        else:
+            run_dob_stage_sync(items, connection, stats)
+    except Exception as e:
+        print(f"Error in DOB stage: {e}")
+    finally:
+        # Keep consuming so the upstream stages never block on a full queue
+        for _ in items:
+            stats.record(False)
+        if connection:
+            ocrai.flush_costs(connection)
+            connection.close()
+
+
+def update_backlog_gauges():
+    """
+    Refreshes the ocr_logs backlog gauges for each stage.
+    """
+    try:
+        for stage, count in db.count_backlog().items():
+            metrics.set_gauge("ocr_pipeline_backlog", count, stage=stage)
+    except Exception as e:
+        print(f"Error counting backlog: {e}")
+
+
+def report_progress(queues, stats, stop, interval):
+    """
+    Prints queue depths and per-stage counters every interval seconds until
+    stopped, and publishes them as gauges.
+    """
+    while not stop.wait(interval):
+        for name, q in queues.items():
+            metrics.set_gauge("ocr_pipeline_queue_depth", q.qsize(), queue=name)
+        update_backlog_gauges()
+        metrics.write_textfile()
+
+        depths = ", ".join(f"{name} queue {q.qsize()}/{q.maxsize}" for name, q in queues.items())
+        counts = ", ".join(f"{s.name} {s.processed} ok / {s.failed} failed" for s in stats)
+        print(f"Pipeline: {depths}; {counts}")
+
+
+def run_pipeline():
+    """
+    Runs ingestion, OCR and DOB extraction as overlapping stages linked by
+    bounded queues, so each document moves on as soon as its previous stage is done.
+    """
+    ocr_queue = queue.Queue(maxsize=int(os.getenv("PIPELINE_OCR_QUEUE_SIZE", 16)))
+    dob_queue = queue.Queue(maxsize=int(os.getenv("PIPELINE_DOB_QUEUE_SIZE", 64)))
+    ocr_stats = StageStats("ocr")
+    dob_stats = StageStats("dob")
+
+    stop = threading.Event()
+    reporter = threading.Thread(
+        target=report_progress,
+        args=({"ocr": ocr_queue, "dob": dob_queue}, [ocr_stats, dob_stats], stop,
+              float(os.getenv("PIPELINE_REPORT_INTERVAL", 10))),
+        daemon=True,
+    )
+
+    # The DOB stage finishes once both the OCR stage and the backlog feeder are done
+    threads = [
+        threading.Thread(target=feed_ocr_queue, args=(ocr_queue,), name="ingest"),
+        threading.Thread(target=feed_dob_backlog, args=(dob_queue,), name="dob-backlog"),
+        threading.Thread(target=run_ocr_stage, args=(ocr_queue, dob_queue, ocr_stats), name="ocr"),
+        threading.Thread(target=run_dob_stage, args=(dob_queue, 2, dob_stats), name="dob"),
+    ]
+
+    update_backlog_gauges()
+
+    start = time.perf_counter()
+    reporter.start()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stop.set()
+
+    print(f"Pipeline finished in {time.perf_counter() - start:.1f}s: "
+          f"{ocr_stats.processed} OCR'd ({ocr_stats.failed} failed), "
+          f"{dob_stats.processed} DOBs extracted ({dob_stats.failed} failed)")
+    ocread.print_fast_engine_stats()
+    ocrai.print_fast_path_stats()
+
+    update_backlog_gauges()
+    metrics.write_textfile()
+
+
+if __name__ == "__main__":
+    run_pipeline()
@@ -0,0 +1,87 @@
+import os
+import io
+import time
+import random
+import inspect
+import threading
+import functools
+import cProfile
+import pstats
+from pathlib import Path
+
+# Set OCR_PROFILE=1 (or pass --profile to cli.py) to profile the OCR and DOB
+# hot paths. Read once at import: when disabled, profiled() hands back the
+# undecorated function, so leaving it in place costs nothing.
+PROFILE_ENABLED = os.getenv("OCR_PROFILE") == "1"
+
+# Fraction of calls to profile, e.g. 0.05 for one document in twenty
+PROFILE_SAMPLE_RATE = float(os.getenv("OCR_PROFILE_SAMPLE_RATE", 1.0))
+
+# Anchored to the code, not the working directory cron happens to start in
+PROFILE_DIR = Path(os.getenv("OCR_PROFILE_DIR", str(Path(__file__).resolve().parent / "profiles")))
+
+# Number of functions listed in each hotspot summary
+PROFILE_TOP_N = int(os.getenv("OCR_PROFILE_TOP_N", 30))
+
+# Only one cProfile profiler can be active per process, so a call that
+# arrives while another thread is being profiled simply runs unprofiled
+active = threading.Lock()
+
+
+def save_profile(profiler, name, doc_id, elapsed):
+    """
+    Writes the raw .prof file and a top-N cumulative-time summary next to it.
+    """
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    stem = f"{name}_{doc_id}_{time.strftime('%Y%m%d-%H%M%S')}_{os.getpid()}"
+    profiler.dump_stats(PROFILE_DIR / f"{stem}.prof")
+
+    summary = io.StringIO()
+    summary.write(f"{name} for doc_id {doc_id} took {elapsed:.3f}s\n\n")
+    stats = pstats.Stats(profiler, stream=summary)
+    stats.sort_stats("cumulative").print_stats(PROFILE_TOP_N)
+    (PROFILE_DIR / f"{stem}.txt").write_text(summary.getvalue())
+
+    print(f"Profile for {name} doc_id {doc_id} saved to {PROFILE_DIR / stem}.prof")
+
+
+def profiled(name, id_param, id_from=None):
+    """
+    Decorator that profiles a sampled share of calls with cProfile and saves
+    one profile per call, named after the id_param argument. For arguments
+    that are not a plain id (e.g. a batch of documents), id_from maps the
+    argument to the label used instead.
+    """
+    def decorator(func):
+        if not PROFILE_ENABLED:
+            return func
+
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if random.random() >= PROFILE_SAMPLE_RATE or not active.acquire(blocking=False):
+                return func(*args, **kwargs)
+
+            try:
+                doc_id = signature.bind_partial(*args, **kwargs).arguments.get(id_param)
+                if id_from:
+                    doc_id = id_from(doc_id)
+                profiler = cProfile.Profile()
+                start = time.perf_counter()
+                profiler.enable()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    profiler.disable()
+                    elapsed = time.perf_counter() - start
+                    try:
+                        save_profile(profiler, name, doc_id, elapsed)
+                    except Exception as e:
+                        print(f"Error saving profile for doc_id {doc_id}: {e}")
+            finally:
+                active.release()
+
+        return wrapper
+
+    return decorator
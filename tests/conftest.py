@@ -0,0 +1,7 @@
+import sys
+from pathlib import Path
+
+# The modules live at the repository root and the OpenAI mock under benchmarks/
+REPO_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_DIR))
+sys.path.insert(0, str(REPO_DIR / "benchmarks"))
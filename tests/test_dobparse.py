@@ -0,0 +1,102 @@
+from datetime import date
+
+import pytest
+
+import dobparse
+
+
+@pytest.mark.parametrize("line", [
+    "DATE OF BIRTH 23/04/1987",
+    "3 DATE OF BIRTH 23/04/1987",
+    "2A DATE OF BIRTH 23/04/1987",
+    "Birth Date: 23/04/1987",
+    "DOB 23/04/1987",
+    "D.O.B. 23/04/1987",
+    "Date de naissance 23/04/1987",
+    "Dale de naissance 23/04/1987",
+    "Fecha de nacimiento 23/04/1987",
+    "Fechi de oicimiento 23/04/1987",
+    "Geburtsdatum 23.04.1987",
+    "Data di nascita 23/04/1987",
+    "Data de nascimento 23/04/1987",
+    "Fecha nac. 23/04/1987",
+])
+def test_label_variants(line):
+    assert dobparse.extract_dob(line) == ("1987-04-23", 0.95)
+
+
+def test_label_does_not_match_inside_words():
+    assert not dobparse.DOB_LABEL_PATTERN.search("Adobe Reader 1987")
+
+
+def test_label_beats_other_dates():
+    text = "4a ISS 01/02/2020\n3 DATE OF BIRTH 23/11/1975\n4b EXP 01/02/2030"
+    assert dobparse.extract_dob(text) == ("1975-11-23", 0.95)
+
+
+def test_date_on_line_after_label():
+    text = "DATE OF BIRTH\n23/11/1975"
+    assert dobparse.extract_dob(text) == ("1975-11-23", 0.85)
+
+
+@pytest.mark.parametrize("line, expected", [
+    ("DOB 1987-04-12", "1987-04-12"),
+    ("DOB 12 APR 1987", "1987-04-12"),
+    ("DOB 12-Apr-1987", "1987-04-12"),
+    ("DOB April 12, 1987", "1987-04-12"),
+    ("Date de naissance 12 avril 1987", "1987-04-12"),
+    ("Fecha de nacimiento 12 diciembre 1987", "1987-12-12"),
+])
+def test_month_names_and_iso(line, expected):
+    assert dobparse.extract_dob(line) == (expected, 0.95)
+
+
+def test_unambiguous_numeric_order():
+    # 23 cannot be a month, and 11/23 cannot be a day/month
+    assert dobparse.extract_dob("DOB 23/11/1975")[0] == "1975-11-23"
+    assert dobparse.extract_dob("DOB 11/23/1975")[0] == "1975-11-23"
+
+
+def test_ambiguous_numeric_date_is_capped(monkeypatch):
+    monkeypatch.setattr(dobparse, "AMBIGUOUS_DATE_ORDER", "")
+    assert dobparse.extract_dob("DOB 04/05/1990") == ("1990-05-04", 0.5)
+
+
+@pytest.mark.parametrize("order, expected", [("dmy", "1990-05-04"), ("mdy", "1990-04-05")])
+def test_ambiguous_date_order_setting(monkeypatch, order, expected):
+    monkeypatch.setattr(dobparse, "AMBIGUOUS_DATE_ORDER", order)
+    assert dobparse.extract_dob("DOB 04/05/1990") == (expected, 0.95)
+
+
+def test_same_day_and_month_is_not_ambiguous(monkeypatch):
+    monkeypatch.setattr(dobparse, "AMBIGUOUS_DATE_ORDER", "")
+    assert dobparse.extract_dob("DOB 05/05/1990") == ("1990-05-05", 0.95)
+
+
+def test_age_plausibility_filter():
+    today = date.today()
+    too_young = f"DOB 01/01/{today.year - dobparse.MIN_AGE + 1}"
+    too_old = f"DOB 01/01/{today.year - dobparse.MAX_AGE - 1}"
+    assert dobparse.extract_dob(too_young) == (None, 0.0)
+    assert dobparse.extract_dob(too_old) == (None, 0.0)
+    assert dobparse.make_date(today.year - dobparse.MIN_AGE, 1, 1) is not None
+    assert dobparse.make_date(1990, 2, 30) is None
+
+
+def test_single_unlabelled_date():
+    assert dobparse.extract_dob("JANE DOE\n23/11/1975") == ("1975-11-23", 0.6)
+
+
+def test_several_unlabelled_dates_pick_earliest_with_low_confidence():
+    text = "23/11/1975\n01/02/2001"
+    assert dobparse.extract_dob(text) == ("1975-11-23", 0.3)
+
+
+def test_conflicting_labelled_dates_are_capped():
+    text = "DOB 23/11/1975\nDate of birth 24/11/1975"
+    assert dobparse.extract_dob(text) == ("1975-11-23", 0.5)
+
+
+@pytest.mark.parametrize("text", ["", "DRIVER LICENSE\nNO DATES HERE"])
+def test_no_date(text):
+    assert dobparse.extract_dob(text) == (None, 0.0)
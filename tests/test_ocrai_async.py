@@ -0,0 +1,130 @@
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip("dotenv")
+pytest.importorskip("mysql.connector")
+pytest.importorskip("openai")
+
+import metrics  # noqa: E402
+import ocrai  # noqa: E402
+from mock_openai import start_mock_server  # noqa: E402
+
+CARD_TEXT = "DRIVER LICENSE\n3 DATE OF BIRTH 23/11/1975\n4a ISS 01/02/2024"
+
+
+@pytest.fixture
+def mock_server():
+    servers = []
+
+    def start(**kwargs):
+        server, base_url = start_mock_server(latency=0, jitter=0, **kwargs)
+        servers.append(server)
+        return server, base_url
+
+    yield start
+    for server in servers:
+        server.shutdown()
+
+
+@pytest.fixture(autouse=True)
+def no_prompt_compaction(monkeypatch):
+    # Compaction needs tiktoken's encoder files; the prompt content is irrelevant here
+    monkeypatch.setattr(ocrai, "compact_ocr_text", lambda text, file_id: text)
+    yield
+    ocrai.pending_costs.clear()
+
+
+def async_client(base_url):
+    from openai import AsyncOpenAI
+    return AsyncOpenAI(api_key="test", base_url=base_url, max_retries=0)
+
+
+def test_token_bucket_limits_request_rate():
+    async def acquire_all():
+        bucket = ocrai.TokenBucket(rate=20, capacity=1)
+        start = time.monotonic()
+        for _ in range(5):
+            await bucket.acquire()
+        return time.monotonic() - start
+
+    # One token up front, then one every 50ms
+    assert asyncio.run(acquire_all()) >= 0.18
+
+
+def test_token_bucket_pause_delays_acquire():
+    async def acquire_after_pause():
+        bucket = ocrai.TokenBucket(rate=100, capacity=10)
+        bucket.pause(0.2)
+        start = time.monotonic()
+        await bucket.acquire()
+        return time.monotonic() - start
+
+    assert asyncio.run(acquire_after_pause()) >= 0.18
+
+
+def test_rate_limited_request_is_retried_after_retry_after(mock_server):
+    server, base_url = mock_server(rate_limit_every=2, retry_after=0.3)
+    rate_limited_before = metrics.counters.get(("ocr_pipeline_rate_limited_total", (("stage", "dob"),)), 0)
+
+    async def extract_twice():
+        client = async_client(base_url)
+        bucket = ocrai.TokenBucket(rate=100, capacity=10)
+        try:
+            first = await ocrai.extract_dob_from_text_async(client, bucket, CARD_TEXT, 1)
+            start = time.monotonic()
+            # The second request gets a 429 and is retried once Retry-After has passed
+            second = await ocrai.extract_dob_from_text_async(client, bucket, CARD_TEXT, 2)
+            return first, second, time.monotonic() - start
+        finally:
+            await client.close()
+
+    first, second, elapsed = asyncio.run(extract_twice())
+
+    assert first == second == "1975-11-23"
+    assert elapsed >= 0.28
+    assert server.request_count == 3
+    assert server.rate_limited_count == 1
+    assert metrics.counters[("ocr_pipeline_rate_limited_total", (("stage", "dob"),))] == rate_limited_before + 1
+
+
+def test_gives_up_after_max_retries(mock_server, monkeypatch):
+    server, base_url = mock_server(rate_limit_every=1, retry_after=0)
+    monkeypatch.setenv("OPENAI_MAX_RETRIES", "2")
+
+    async def extract():
+        client = async_client(base_url)
+        try:
+            return await ocrai.extract_dob_from_text_async(client, ocrai.TokenBucket(rate=100, capacity=10),
+                                                           CARD_TEXT, 1)
+        finally:
+            await client.close()
+
+    assert asyncio.run(extract()) is None
+    assert server.request_count == 3
+
+
+def test_results_are_written_back_while_rows_trickle_in(mock_server, monkeypatch):
+    server, base_url = mock_server()
+    monkeypatch.setenv("OPENAI_BASE_URL", base_url)
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.setenv("OPENAI_REQUESTS_PER_SECOND", "100")
+    monkeypatch.setattr(ocrai, "flush_costs", lambda connection: None)
+
+    start = time.monotonic()
+    written = {}
+    monkeypatch.setattr(ocrai.db, "update_dob",
+                        lambda connection, file_id, dob, status: written.setdefault(file_id, time.monotonic() - start))
+
+    def slow_rows():
+        # Like a pipeline queue waiting on the OCR stage
+        for file_id in range(1, 5):
+            time.sleep(0.3)
+            yield file_id, CARD_TEXT
+
+    asyncio.run(ocrai.extract_dobs_async(slow_rows(), connection=None))
+
+    assert sorted(written) == [1, 2, 3, 4]
+    # The first answer lands long before the last row arrives at ~1.2s
+    assert written[1] < 0.9
@@ -0,0 +1,137 @@
+import json
+
+import pytest
+
+pytest.importorskip("dotenv")
+pytest.importorskip("mysql.connector")
+pytest.importorskip("openai")
+
+import db  # noqa: E402
+import ocrai  # noqa: E402
+from mock_openai import start_mock_server  # noqa: E402
+
+# Ambiguous day/month order, so the local parser defers to the LLM
+ROWS = [
+    {"id": 1, "response_data": "DRIVER LICENSE\nDATE OF BIRTH 04/05/1990"},
+    {"id": 2, "response_data": "DRIVER LICENSE\nDATE OF BIRTH 03/02/1981"},
+]
+
+
+@pytest.fixture
+def batch_env(tmp_path, monkeypatch):
+    from openai import OpenAI
+
+    server, base_url = start_mock_server(latency=0, jitter=0, batch_latency=0.1)
+    monkeypatch.setattr(ocrai, "client", OpenAI(api_key="test", base_url=base_url))
+    monkeypatch.setattr(ocrai, "BATCH_DIR", tmp_path)
+    monkeypatch.setattr(ocrai, "BATCH_STATE_FILE", tmp_path / "batch_state.json")
+    monkeypatch.setattr(ocrai, "compact_ocr_text", lambda text, file_id: text)
+    monkeypatch.setenv("OCRAI_BATCH_POLL_INTERVAL", "0.05")
+
+    # Record the DOB write-backs and cost rows instead of touching MySQL
+    updates = []
+    costs = []
+    monkeypatch.setattr(db, "update_dob", lambda connection, file_id, dob, status: updates.append((dob, status, file_id)))
+    monkeypatch.setattr(db, "update_dobs", lambda connection, rows: updates.extend(rows))
+
+    def flush_costs(connection):
+        costs.extend(ocrai.pending_costs)
+        ocrai.pending_costs.clear()
+    monkeypatch.setattr(ocrai, "flush_costs", flush_costs)
+
+    yield server, updates, costs
+    server.shutdown()
+
+
+def token_usage(server):
+    batch = next(iter(server.batches.values()))
+    line = server.files[batch["output_file_id"]]["content"].decode().splitlines()[0]
+    usage = json.loads(line)["response"]["body"]["usage"]
+    return usage["prompt_tokens"], usage["completion_tokens"]
+
+
+def test_bulk_mode_submits_polls_and_applies(batch_env):
+    server, updates, costs = batch_env
+
+    ocrai.run_dob_batch(iter(ROWS), connection=None)
+
+    assert len(server.batches) == 1
+    assert ('', 'batch_pending', 1) in updates
+    assert ("1990-05-04", ocrai.dob_status("1990-05-04"), 1) in updates
+    assert ("1981-02-03", ocrai.dob_status("1981-02-03"), 2) in updates
+    assert not ocrai.BATCH_STATE_FILE.exists()
+    assert [file_id for file_id, _, _ in costs] == [1, 2]
+
+
+def test_batch_cost_uses_batch_price(batch_env, monkeypatch):
+    _, _, costs = batch_env
+    monkeypatch.setenv("TOKEN_COST", "1.0")
+    monkeypatch.setattr(ocrai, "BATCH_PRICE_MULTIPLIER", 0.5)
+
+    ocrai.run_dob_batch(iter(ROWS[:1]), connection=None)
+
+    batch_cost = costs[0][1]
+    assert batch_cost == pytest.approx(ocrai.calculate_cost(*token_usage(batch_env[0]), model="gpt-4o") * 0.5)
+
+
+def test_resume_reuses_batch_created_before_a_crash(batch_env):
+    server, updates, _ = batch_env
+
+    # Simulate a crash right after batches.create: the state has the input file but no
+    # batch id (written in the single-batch format used before backlogs were split)
+    input_file = ocrai.get_client().files.create(
+        file=("input.jsonl", b'{"custom_id": "1", "method": "POST", "url": "/v1/chat/completions", '
+                             b'"body": {"model": "gpt-4o", "messages": [{"role": "user", '
+                             b'"content": "DATE OF BIRTH 04/05/1990"}]}}\n'),
+        purpose="batch",
+    )
+    ocrai.get_client().batches.create(input_file_id=input_file.id, endpoint="/v1/chat/completions",
+                                      completion_window="24h")
+    ocrai.write_batch_state({"input_file_id": input_file.id, "batch_id": None, "file_ids": [1]})
+
+    ocrai.run_dob_batch(iter(ROWS), connection=None)
+
+    assert len(server.batches) == 1
+    assert updates == [("1990-05-04", ocrai.dob_status("1990-05-04"), 1)]
+
+
+def test_resume_creates_missing_batch(batch_env):
+    server, updates, _ = batch_env
+
+    # Crash after the upload and the state write, before batches.create
+    input_file = ocrai.get_client().files.create(
+        file=("input.jsonl", b'{"custom_id": "2", "method": "POST", "url": "/v1/chat/completions", '
+                             b'"body": {"model": "gpt-4o", "messages": [{"role": "user", '
+                             b'"content": "DATE OF BIRTH 03/02/1981"}]}}\n'),
+        purpose="batch",
+    )
+    ocrai.write_batch_state({"batches": [{"input_file_id": input_file.id, "batch_id": None, "file_ids": [2]}]})
+
+    ocrai.run_dob_batch(iter(ROWS), connection=None)
+
+    assert len(server.batches) == 1
+    assert updates == [("1981-02-03", ocrai.dob_status("1981-02-03"), 2)]
+
+
+def test_large_backlog_is_split_into_several_batches(batch_env, monkeypatch):
+    server, updates, _ = batch_env
+    monkeypatch.setattr(ocrai, "BATCH_MAX_REQUESTS", 1)
+
+    ocrai.run_dob_batch(iter(ROWS), connection=None)
+
+    assert len(server.batches) == 2
+    assert ("1990-05-04", ocrai.dob_status("1990-05-04"), 1) in updates
+    assert ("1981-02-03", ocrai.dob_status("1981-02-03"), 2) in updates
+    assert not ocrai.BATCH_STATE_FILE.exists()
+
+
+def test_input_files_stay_under_the_size_cap(batch_env, monkeypatch):
+    # Roomy enough for one request per file, too small for two
+    line_size = len(json.dumps({"custom_id": "1", "method": "POST", "url": "/v1/chat/completions", "body": {
+        "model": "gpt-4o", "messages": ocrai.build_dob_messages(ROWS[0]["response_data"])}})) + 1
+    monkeypatch.setattr(ocrai, "BATCH_MAX_BYTES", line_size + 10)
+
+    files = list(ocrai.write_batch_input_files((row["id"], row["response_data"]) for row in ROWS))
+
+    assert [file_ids for _, file_ids in files] == [[1], [2]]
+    assert all(path.stat().st_size <= line_size + 10 for path, _ in files)
@@ -0,0 +1,69 @@
+import pytest
+
+pytest.importorskip("dotenv")
+pytest.importorskip("mysql.connector")
+
+import ocrai  # noqa: E402
+
+
+class WordEncoding:
+    """
+    Stand-in for a tiktoken encoder with one token per word.
+    """
+
+    def encode(self, text):
+        return text.split()
+
+    def decode(self, tokens):
+        return " ".join(tokens)
+
+
+@pytest.fixture
+def word_tokens(monkeypatch):
+    monkeypatch.setattr(ocrai, "get_encoding", lambda model: WordEncoding())
+
+
+def test_full_text_is_sent_when_the_tokenizer_is_unavailable(monkeypatch):
+    def missing(model):
+        raise ModuleNotFoundError("No module named 'tiktoken'")
+    monkeypatch.setattr(ocrai, "get_encoding", missing)
+
+    text = "DRIVER LICENSE\nDATE OF BIRTH 23/11/1975"
+    assert ocrai.compact_ocr_text(text, 1) == text
+
+
+def test_llm_errors_do_not_escape_when_the_tokenizer_fails(monkeypatch):
+    def broken(text, file_id):
+        raise ModuleNotFoundError("No module named 'tiktoken'")
+    monkeypatch.setattr(ocrai, "compact_ocr_text", broken)
+    monkeypatch.setattr(ocrai, "extract_dob_locally", lambda text, file_id: None)
+
+    assert ocrai.extract_dob_from_text("no date here", 1) is None
+
+
+def test_lines_away_from_anchors_are_dropped(word_tokens):
+    lines = ["noise"] * 10 + ["DATE OF BIRTH", "23/11/1975"] + ["noise"] * 10
+    compacted = ocrai.compact_ocr_text("\n".join(lines), 1).splitlines()
+    assert "DATE OF BIRTH" in compacted and "23/11/1975" in compacted
+    assert len(compacted) < len(lines)
+
+
+def test_oversized_first_window_is_truncated_to_the_budget(word_tokens, monkeypatch):
+    monkeypatch.setattr(ocrai, "DOB_PROMPT_TOKEN_BUDGET", 20)
+    long_line = " ".join(["filler"] * 50)
+    text = "\n".join([long_line, long_line, "DATE OF BIRTH 23/11/1975", long_line, long_line])
+
+    compacted = ocrai.compact_ocr_text(text, 1)
+
+    assert "DATE OF BIRTH 23/11/1975" in compacted
+    assert sum(len(line.split()) + 1 for line in compacted.splitlines()) <= 20
+
+
+def test_oversized_anchor_line_is_cut(word_tokens, monkeypatch):
+    monkeypatch.setattr(ocrai, "DOB_PROMPT_TOKEN_BUDGET", 10)
+    text = "DATE OF BIRTH 23/11/1975 " + " ".join(["filler"] * 50)
+
+    compacted = ocrai.compact_ocr_text(text, 1)
+
+    assert compacted.startswith("DATE OF BIRTH 23/11/1975")
+    assert len(compacted.split()) <= 10
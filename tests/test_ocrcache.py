@@ -0,0 +1,41 @@
+import sqlite3
+
+import pytest
+
+import ocrcache
+
+
+@pytest.fixture
+def cache_path(tmp_path, monkeypatch):
+    path = tmp_path / "ocr_cache.sqlite3"
+    monkeypatch.setattr(ocrcache, "CACHE_PATH", str(path))
+    monkeypatch.setattr(ocrcache, "connection", None)
+    yield path
+    if ocrcache.connection is not None:
+        ocrcache.connection.close()
+    ocrcache.connection = None
+
+
+def test_cached_text_keeps_its_engine(cache_path):
+    ocrcache.store_cached_text("key", "DATE OF BIRTH 23/04/1987", "tesseract")
+    assert ocrcache.get_cached_text("key") == ("DATE OF BIRTH 23/04/1987", "tesseract")
+    assert ocrcache.get_cached_text("other") is None
+
+
+def test_cache_without_engine_column_is_migrated(cache_path):
+    legacy = sqlite3.connect(cache_path)
+    legacy.execute("""
+        CREATE TABLE ocr_result_cache (
+            cache_key TEXT PRIMARY KEY,
+            response_data TEXT NOT NULL,
+            last_used REAL NOT NULL
+        )
+    """)
+    legacy.execute("INSERT INTO ocr_result_cache VALUES ('old', 'old text', 0)")
+    legacy.commit()
+    legacy.close()
+
+    # Old entries have no engine; new ones record it
+    assert ocrcache.get_cached_text("old") == ("old text", None)
+    ocrcache.store_cached_text("new", "new text", "doctr")
+    assert ocrcache.get_cached_text("new") == ("new text", "doctr")
@@ -0,0 +1,108 @@
+import sys
+import threading
+import types
+
+import pytest
+
+pytest.importorskip("dotenv")
+pytest.importorskip("mysql.connector")
+
+import ocread  # noqa: E402
+
+
+class FakePage:
+    def __init__(self, number, fail):
+        self.number = number
+        self.fail = fail
+
+    def to_image(self, resolution):
+        if self.fail:
+            raise ValueError(f"cannot render page {self.number}")
+        return types.SimpleNamespace(original=f"image {self.number}")
+
+    def close(self):
+        pass
+
+
+class FakePDF:
+    def __init__(self, pages, fail_on):
+        self.pages = [FakePage(number, number == fail_on) for number in range(pages)]
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.closed = True
+
+
+@pytest.fixture
+def fake_pdf(monkeypatch):
+    """
+    Replaces pdfplumber and the image helpers so rasterising is instant, and
+    returns a factory for a PDF whose fail_on page cannot be rendered.
+    """
+    opened = []
+
+    def make(pages, fail_on=None):
+        pdf = FakePDF(pages, fail_on)
+        monkeypatch.setitem(sys.modules, "pdfplumber", types.SimpleNamespace(open=lambda path: pdf))
+        opened.append(pdf)
+        return pdf
+
+    monkeypatch.setattr(ocread, "preprocess_image", lambda image: image)
+    monkeypatch.setattr(ocread, "load_image_pages", lambda image: [image])
+    monkeypatch.setattr(ocread, "pages_to_text", lambda pages: " ".join(pages))
+    monkeypatch.setattr(ocread, "PDF_RASTER_QUEUE_SIZE", 1)
+    return make
+
+
+def rasteriser_threads():
+    return [thread for thread in threading.enumerate() if thread.name != "MainThread" and thread.is_alive()]
+
+
+def test_all_pages_are_ocrd(fake_pdf, monkeypatch):
+    fake_pdf(3)
+    monkeypatch.setattr(ocread, "get_predictor", lambda: lambda pages: types.SimpleNamespace(pages=pages))
+
+    texts = ocread.ocr_scanned_pdf_pages("scan.pdf", [0, 1, 2], doc_id=1)
+
+    assert texts == {0: "image 0", 1: "image 1", 2: "image 2"}
+
+
+def test_rasterise_error_is_raised_not_dropped(fake_pdf, monkeypatch):
+    fake_pdf(3, fail_on=1)
+    monkeypatch.setattr(ocread, "get_predictor", lambda: lambda pages: types.SimpleNamespace(pages=pages))
+
+    with pytest.raises(ValueError, match="cannot render page 1"):
+        ocread.ocr_scanned_pdf_pages("scan.pdf", [0, 1, 2], doc_id=1)
+
+
+def test_predictor_error_stops_the_rasteriser(fake_pdf, monkeypatch):
+    pdf = fake_pdf(10)
+    before = rasteriser_threads()
+
+    def predictor(pages):
+        raise RuntimeError("out of memory")
+    monkeypatch.setattr(ocread, "get_predictor", lambda: predictor)
+
+    with pytest.raises(RuntimeError):
+        ocread.ocr_scanned_pdf_pages("scan.pdf", list(range(10)), doc_id=1)
+
+    # The rasteriser was blocked on the full queue; it must have exited and closed the PDF
+    assert rasteriser_threads() == before
+    assert pdf.closed
+
+
+def test_partial_pdf_is_not_written_back(fake_pdf, monkeypatch):
+    fake_pdf(3, fail_on=2)
+    monkeypatch.setattr(ocread, "get_predictor", lambda: lambda pages: types.SimpleNamespace(pages=pages))
+    monkeypatch.setattr(ocread, "ROI_MODE", False)
+    # Every page is image-only, so all of them go through the rasteriser
+    for page in sys.modules["pdfplumber"].open("scan.pdf").pages:
+        page.extract_text = lambda: ""
+    written = []
+    monkeypatch.setattr(ocread, "update_response_data", lambda *args: written.append(args))
+
+    assert ocread.extract_text_from_pdf("scan.pdf", 1) == (None, None)
+    assert written == []
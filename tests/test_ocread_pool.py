@@ -0,0 +1,77 @@
+import os
+
+import pytest
+
+pytest.importorskip("dotenv")
+pytest.importorskip("mysql.connector")
+
+import ocread  # noqa: E402
+
+
+@pytest.fixture
+def fake_pool(monkeypatch):
+    """
+    Forked pool workers that skip the model and read a row's text from its
+    id: rows with id 13 kill their worker.
+    """
+    monkeypatch.setenv("OCR_TORCH_THREADS", "1")
+    monkeypatch.setattr(ocread, "init_ocr_worker", lambda torch_threads: None)
+
+    def process_row(row):
+        if row["id"] == 13:
+            os._exit(1)
+        return f"{row['id']}:{os.getpid()}"
+    monkeypatch.setattr(ocread, "process_row", process_row)
+    yield
+    ocread.discard_ocr_pool()
+
+
+def run(ids):
+    results = {}
+    ocread.process_rows_parallel([{"id": i} for i in ids], 2, lambda doc_id, text: results.setdefault(doc_id, text),
+                                 start_method="fork")
+    return results
+
+
+def test_pool_is_reused_between_runs(fake_pool):
+    first = run(range(1, 9))
+    pool = ocread.ocr_pool
+    second = run(range(9, 13))
+
+    assert ocread.ocr_pool is pool
+    worker_pids = {text.split(":")[1] for text in first.values()}
+    assert {text.split(":")[1] for text in second.values()} <= worker_pids
+
+
+def test_dead_worker_only_skips_its_document(fake_pool):
+    results = run(range(10, 17))
+    pool = ocread.ocr_pool
+
+    assert results[13] is None
+    assert all(results[i] for i in range(10, 17) if i != 13)
+
+    # The broken pool was replaced and the new one is kept for the next run
+    run([20])
+    assert ocread.ocr_pool is pool
+
+
+def test_worker_cache_and_fast_engine_counts_reach_the_parent(fake_pool, monkeypatch):
+    def process_row(row):
+        # Every other document is a cache hit; the rest go through the fast engine
+        if row["id"] % 2:
+            ocread.ocrcache.hits += 1
+        else:
+            ocread.ocrcache.misses += 1
+            ocread.fast_engine_hits += 1
+        return "text"
+    monkeypatch.setattr(ocread, "process_row", process_row)
+    monkeypatch.setattr(ocread.ocrcache, "hits", 0)
+    monkeypatch.setattr(ocread.ocrcache, "misses", 0)
+    monkeypatch.setattr(ocread, "fast_engine_hits", 0)
+    monkeypatch.setattr(ocread, "fast_engine_escalations", 0)
+
+    run(range(1, 11))
+
+    assert ocread.ocrcache.cache_stats()["hits"] == 5
+    assert ocread.ocrcache.cache_stats()["misses"] == 5
+    assert ocread.fast_engine_hits == 5
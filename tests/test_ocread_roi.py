@@ -0,0 +1,24 @@
+import pytest
+
+pytest.importorskip("dotenv")
+pytest.importorskip("mysql.connector")
+
+import ocread  # noqa: E402
+
+
+@pytest.mark.parametrize("text, accepted", [
+    ("DATE OF BIRTH 23/04/1987", True),
+    ("DOB\n23/04/1987", True),
+    # Unlabelled dates are too weak to skip whole-page recognition
+    ("23/04/1987", False),
+    ("12/04/1987", False),
+    ("DRIVER LICENSE", False),
+    (None, False),
+])
+def test_roi_text_needs_a_confident_dob(text, accepted):
+    assert ocread.accept_roi_text(text, 1) is accepted
+
+
+def test_roi_threshold_is_configurable(monkeypatch):
+    monkeypatch.setattr(ocread, "ROI_MIN_DOB_CONFIDENCE", 0.5)
+    assert ocread.accept_roi_text("23/04/1987", 1) is True
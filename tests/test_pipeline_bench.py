@@ -0,0 +1,26 @@
+import pytest
+
+pytest.importorskip("PIL")
+
+from pipeline_bench import percentile, summarise  # noqa: E402
+
+
+@pytest.mark.parametrize("fraction, expected", [(0.50, 10), (0.95, 19), (0.99, 20), (1.0, 20), (0.01, 1)])
+def test_nearest_rank_percentile(fraction, expected):
+    assert percentile(list(range(1, 21)), fraction) == expected
+
+
+def test_percentile_of_hundred_values():
+    values = list(range(1, 101))
+    assert [percentile(values, f) for f in (0.50, 0.95, 0.99)] == [50, 95, 99]
+
+
+def test_percentile_of_single_value():
+    assert percentile([0.3], 0.99) == 0.3
+
+
+def test_unmeasured_latencies_are_reported_as_none():
+    summary = summarise("ingest", None, 2.0, 10)
+    assert summary["latency_measured"] is False
+    assert summary["p50"] is summary["p95"] is summary["p99"] is None
+    assert summary["docs_per_sec"] == 5.0
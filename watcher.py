@@ -0,0 +1,158 @@
+import os
+import time
+
+import db
+from dbread import resolve_file_directory
+from pipeline import run_pipeline
+
+# How often the avsdocs high-water mark is checked when nothing is happening,
+# and how quickly it is re-checked right after an upload lands on disk
+WATCH_POLL_INTERVAL = float(os.getenv("WATCH_POLL_INTERVAL", 5))
+WATCH_SETTLE_INTERVAL = float(os.getenv("WATCH_SETTLE_INTERVAL", 1))
+WATCH_SETTLE_SECONDS = float(os.getenv("WATCH_SETTLE_SECONDS", 15))
+
+# With inotify available the DB is only polled this often as a safety net
+WATCH_INOTIFY_POLL_INTERVAL = float(os.getenv("WATCH_INOTIFY_POLL_INTERVAL", 60))
+
+
+def latest_avsdocs_id():
+    """
+    Returns the highest avsdocs id, a cheap primary-key lookup used as a change marker.
+    """
+    connection = db.get_connection()
+    cursor = connection.cursor()
+    try:
+        cursor.execute("SELECT MAX(`id`) FROM `avsdocs`")
+        return cursor.fetchone()[0] or 0
+    finally:
+        cursor.close()
+        connection.close()
+
+
+class UploadWatch:
+    """
+    Recursive inotify watch on FILE_DIRECTORY. inotify watches are not
+    recursive, so every subdirectory gets its own watch, including ones
+    created after the watch was opened.
+    """
+
+    def __init__(self, inotify, flags):
+        self.inotify = inotify
+        self.flags = flags
+        self.paths = {}
+
+    def add_tree(self, root):
+        """
+        Watches root and every directory below it.
+        """
+        mask = self.flags.CLOSE_WRITE | self.flags.MOVED_TO | self.flags.CREATE
+        for directory, _, _ in os.walk(root):
+            try:
+                self.paths[self.inotify.add_watch(directory, mask)] = directory
+            except OSError as e:
+                # Raced with a removal, or hit fs.inotify.max_user_watches
+                print(f"Error watching {directory}: {e}")
+
+    def read(self, timeout):
+        """
+        Waits up to timeout seconds for events. Returns True if any arrived.
+        """
+        events = self.inotify.read(timeout=int(timeout * 1000))
+        for event in events:
+            if event.mask & self.flags.IGNORED:
+                self.paths.pop(event.wd, None)
+            elif event.mask & self.flags.ISDIR and event.mask & (self.flags.CREATE | self.flags.MOVED_TO):
+                # Files may already be inside a directory created or moved in
+                # before its watch exists; the DB check after this catches them
+                parent = self.paths.get(event.wd)
+                if parent:
+                    self.add_tree(os.path.join(parent, event.name))
+        return bool(events)
+
+
+def open_upload_watch():
+    """
+    Returns a recursive UploadWatch on FILE_DIRECTORY, or None when
+    inotify_simple is not installed, WATCH_INOTIFY=0, or the directory is missing.
+    """
+    if os.getenv("WATCH_INOTIFY", "1") == "0":
+        return None
+
+    try:
+        from inotify_simple import INotify, flags
+    except ImportError:
+        print("inotify_simple is not installed, watching avsdocs by polling only.")
+        return None
+
+    file_directory = resolve_file_directory()
+    if not file_directory or not file_directory.exists():
+        print("FILE_DIRECTORY is not available, watching avsdocs by polling only.")
+        return None
+
+    watch = UploadWatch(INotify(), flags)
+    watch.add_tree(str(file_directory))
+    print(f"Watching {file_directory} and {len(watch.paths) - 1} subdirectories for new uploads.")
+    return watch
+
+
+def wait_for_activity(watch, timeout):
+    """
+    Sleeps up to timeout seconds, returning early with True if an upload lands.
+    """
+    if watch is None:
+        time.sleep(timeout)
+        return False
+    return watch.read(timeout)
+
+
+def run_daemon():
+    """
+    Runs the pipeline whenever new documents arrive instead of on a cron schedule.
+
+    New uploads are detected by the avsdocs id high-water mark and, when
+    available, an inotify watch on FILE_DIRECTORY. While idle the process
+    blocks in sleep or inotify and issues one MAX(id) query per poll interval.
+    After a file lands the mark is re-checked quickly for a short while, since
+    the avsdocs row can be committed after the file is written.
+
+    The DB is only polled at the slower WATCH_INOTIFY_POLL_INTERVAL once the
+    watch has actually reported an upload. If new documents show up without
+    any inotify event (uploads landing outside the watched tree, a network
+    mount that does not deliver events) it goes back to WATCH_POLL_INTERVAL.
+    """
+    watch = open_upload_watch()
+    watch_trusted = False
+    saw_activity = False
+
+    # Process anything already waiting before settling into the watch loop
+    high_water = latest_avsdocs_id()
+    run_pipeline()
+
+    settle_until = 0.0
+    while True:
+        idle_interval = WATCH_INOTIFY_POLL_INTERVAL if watch_trusted else WATCH_POLL_INTERVAL
+        interval = WATCH_SETTLE_INTERVAL if time.monotonic() < settle_until else idle_interval
+        if wait_for_activity(watch, interval):
+            settle_until = time.monotonic() + WATCH_SETTLE_SECONDS
+            saw_activity = True
+
+        try:
+            latest = latest_avsdocs_id()
+        except Exception as e:
+            print(f"Error checking avsdocs: {e}")
+            continue
+
+        if latest > high_water:
+            print(f"New documents detected (avsdocs id {high_water} -> {latest}), running pipeline.")
+            if watch and saw_activity != watch_trusted:
+                print("Upload watch is delivering events, polling avsdocs less often." if saw_activity
+                      else "New documents arrived without an upload event, polling avsdocs more often.")
+            watch_trusted = saw_activity
+            saw_activity = False
+            high_water = latest
+            settle_until = 0.0
+            run_pipeline()
+
+
+if __name__ == "__main__":
+    run_daemon()